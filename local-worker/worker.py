@@ -14,12 +14,26 @@ from uuid import uuid4
 import socket
 
 # Supabase Python クライアント
-from supabase import create_client, Client
-from playwright.async_api import async_playwright, Browser, Page
+from supabase import Client
 
-# 既存のFacebook自動化コードを流用
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from working_solution.facebook_automation_complete import FacebookAutomation
+from cryptography.fernet import Fernet
+
+# ワーカー共通モジュール（worker/）を流用（Facebook自動化もworker/facebook_automation.pyを使用）
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "worker"))
+from automation_pool import AutomationPool
+from session_store import SessionStore
+from thread_cache import ThreadCache
+from account_cache import AccountCache
+from rate_limiter import AccountRateLimiter
+from scheduler import TaskScheduler
+from db import AsyncDB, create_supabase_client
+from log_sink import LogSink
+from metrics_server import MetricsServer, LOOP_ITERATION
+from system_metrics import SystemMetricsSampler
+from outbox import TaskOutbox
+from spans import tracer
+from task_queue import TaskQueue, PermanentTaskError, is_claimable
+from realtime_listener import RealtimeListener
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,26 +43,62 @@ class LocalWorker:
     """Supabaseと連携するローカルワーカー"""
     
     def __init__(self, supabase_url: str, supabase_key: str, worker_api_key: str):
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        self.supabase: Client = create_supabase_client(supabase_url, supabase_key)
+        self.db = AsyncDB(self.supabase)
+        self.log_sink = LogSink(self.db)
+        self.supabase_url = supabase_url
+        self.supabase_key = supabase_key
+        self.access_token = None
         self.worker_api_key = worker_api_key
         self.worker_id = None
         self.worker_name = f"worker-{socket.gethostname()}"
-        self.automations: Dict[str, FacebookAutomation] = {}
+        self.cipher = Fernet(os.getenv("ENCRYPTION_KEY").encode())
+        self.sessions = SessionStore(self.cipher)
+        self.thread_cache = ThreadCache()
+        self.automations = AutomationPool(self.sessions, self.thread_cache)
+        self.accounts = AccountCache(self.db, self.cipher)
+        self.rate_limiter = AccountRateLimiter(self.db, self.accounts)
+        self.max_concurrent = int(os.getenv("MAX_CONCURRENT", "3"))
+        self.task_queue = TaskQueue(self.db, batch_size=self.max_concurrent)
+        self.outbox = TaskOutbox(self.task_queue)
         self.running = True
         
+        # Realtimeによるタスク通知（未接続時は通常のポーリング間隔に戻る）
+        self.realtime_enabled = os.getenv("REALTIME_ENABLED", "true").lower() == "true"
+        self.poll_interval = 10
+        self.fallback_poll_interval = int(os.getenv("FALLBACK_POLL_INTERVAL", "60"))
+        self.realtime: Optional[RealtimeListener] = None
+        self.task_event = asyncio.Event()
+        self.claim_requested = True
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        
+        # Prometheusメトリクス・ヘルスチェック（METRICS_PORT設定時のみ、RSSはサンプラーから取得）
+        self.metrics_server = MetricsServer(self.is_healthy)
+        self.metrics = SystemMetricsSampler()
+        
+        # scheduled_at付きタスクの予約スケジューラー
+        self.scheduler = TaskScheduler(self.db)
+        
     async def register_worker(self) -> bool:
         """ワーカーを登録"""
         try:
             # APIキーで認証
-            auth_response = self.supabase.auth.sign_in_with_password(
-                email=os.getenv("WORKER_EMAIL"),
-                password=os.getenv("WORKER_PASSWORD")
+            auth_response = await self.db.call(
+                self.supabase.auth.sign_in_with_password,
+                {
+                    "email": os.getenv("WORKER_EMAIL"),
+                    "password": os.getenv("WORKER_PASSWORD")
+                }
             )
             
             if not auth_response.user:
                 logger.error("Worker authentication failed")
                 return False
             
+            # Realtime購読はRLSに従うためユーザーのトークンを使用
+            if auth_response.session:
+                self.access_token = auth_response.session.access_token
+            
             # ワーカー登録
             worker_data = {
                 "user_id": auth_response.user.id,
@@ -59,17 +109,19 @@ class LocalWorker:
                 "capabilities": {
                     "browser_automation": True,
                     "playwright_version": "1.40.0",
-                    "max_concurrent": 3
+                    "max_concurrent": self.max_concurrent
                 }
             }
             
-            result = self.supabase.table("worker_connections").upsert(
+            result = await self.db.execute(self.db.table("worker_connections").upsert(
                 worker_data,
                 on_conflict="worker_name"
-            ).execute()
+            ))
             
             if result.data:
                 self.worker_id = result.data[0]["id"]
+                self.task_queue.worker_id = self.worker_id
+                tracer.bind(self.log_sink, self.worker_id)
                 logger.info(f"Worker registered: {self.worker_name} (ID: {self.worker_id})")
                 return True
                 
@@ -82,26 +134,35 @@ class LocalWorker:
         while self.running:
             try:
                 if self.worker_id:
-                    self.supabase.table("worker_connections").update({
-                        "last_heartbeat": datetime.utcnow().isoformat(),
-                        "status": "online"
-                    }).eq("id", self.worker_id).execute()
+                    # last_heartbeatの更新・処理中タスクのリース延長・セッション保持中アカウントの公開を1往復で
+                    await self.task_queue.extend_leases(warm_accounts=self.automations.warm_accounts())
+                    
+                    # 障害明けは送信済みタスクの結果を先に反映してから、停止したワーカーが残したリース切れタスクを再キュー
+                    await self.outbox.resume()
+                    await self.task_queue.reap_expired()
                     
                 await asyncio.sleep(30)  # 30秒ごと
                 
             except Exception as e:
                 logger.error(f"Heartbeat error: {e}")
-                await asyncio.sleep(60)
+                # リース期間（既定120秒）内に再送できるよう間隔は延ばさない
+                await asyncio.sleep(30)
     
     async def fetch_pending_tasks(self) -> list:
-        """待機中のタスクを取得"""
+        """待機中のタスクを取得（このワーカーにprocessingとしてリース済み）"""
         try:
-            # 認証ユーザーのタスクのみ取得
-            result = self.supabase.table("tasks").select("*").in_(
-                "status", ["pending", "retry"]
-            ).order("created_at").limit(10).execute()
+            # 長く待たされている低優先度タスクを昇格（一定間隔ごと）
+            await self.task_queue.age_priorities()
+            
+            # 認証ユーザーのタスクのみ優先度→作成日時順に取得（RLS）。当日の送信上限に達したアカウントは除外し、
+            # ブラウザプールにセッションがあるアカウントを優先（他ワーカーが保持するアカウントは猶予後のみ）
+            tasks = await self.task_queue.claim(
+                exclude_accounts=self.rate_limiter.exhausted_accounts(),
+                warm_accounts=self.automations.warm_accounts()
+            )
             
-            return result.data if result.data else []
+            # 同じアカウントのタスクが上限を超える分は延期
+            return [task for task in tasks if await self.rate_limiter.reserve(task, self.outbox)]
             
         except Exception as e:
             logger.error(f"Failed to fetch tasks: {e}")
@@ -112,51 +173,24 @@ class LocalWorker:
         task_id = task["id"]
         
         try:
-            # タスクを処理中に更新
-            self.supabase.table("tasks").update({
-                "status": "processing",
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", task_id).execute()
-            
             # ログ記録
             self.log_action(task_id, "task_started", {
                 "worker": self.worker_name,
                 "task_type": task["task_type"]
             })
             
-            # アカウント情報取得
-            account_result = self.supabase.table("facebook_accounts").select("*").eq(
-                "id", task["account_id"]
-            ).single().execute()
-            
-            if not account_result.data:
-                raise Exception("Account not found")
-            
-            account = account_result.data
+            # アカウント情報取得（キャッシュ済みなら復号済みパスワードをそのまま使う）
+            account = await self.accounts.get(task["account_id"])
             
-            # 復号化（Fernetで暗号化されている前提）
-            from cryptography.fernet import Fernet
-            key = os.getenv("ENCRYPTION_KEY").encode()
-            fernet = Fernet(key)
-            password = fernet.decrypt(account["encrypted_password"].encode()).decode()
-            
-            # Facebook自動化インスタンス取得or作成
-            if account["id"] not in self.automations:
-                automation = FacebookAutomation(
-                    email=account["email"],
-                    password=password,
-                    headless=True  # 本番はTrue、デバッグ時はFalse
-                )
-                await automation.initialize()
-                self.automations[account["id"]] = automation
-            else:
-                automation = self.automations[account["id"]]
+            # Facebook自動化インスタンス取得or作成（上限超過時は最も古いアカウントを追い出し）
+            automation = await self.automations.acquire(account["id"], account["email"])
             
             # タスクタイプに応じて処理
             if task["task_type"] == "send_message":
                 # ログイン（必要な場合）
-                if not await automation.login():
-                    raise Exception("Login failed")
+                if not await automation.is_logged_in():
+                    await automation.login(account["email"], account["password"])
+                    self.sessions.save(account["id"], await automation.export_session())
                 
                 # メッセージ送信
                 success = await automation.send_message(
@@ -166,85 +200,192 @@ class LocalWorker:
                 
                 if success:
                     # 成功
-                    self.supabase.table("tasks").update({
-                        "status": "completed",
-                        "completed_at": datetime.utcnow().isoformat(),
-                        "result": {"success": True, "message": "Message sent successfully"}
-                    }).eq("id", task_id).execute()
-                    
-                    self.log_action(task_id, "task_completed", {
-                        "recipient": task["recipient_name"]
-                    })
+                    self.finish_task(
+                        task_id, "completed",
+                        result={"success": True, "message": "Message sent successfully"},
+                        details={"recipient": task["recipient_name"]}
+                    )
                     
                     return True
                 else:
                     raise Exception("Failed to send message")
             
             else:
-                raise Exception(f"Unknown task type: {task['task_type']}")
+                raise PermanentTaskError(f"Unknown task type: {task['task_type']}")
                 
         except Exception as e:
             logger.error(f"Task processing error: {e}")
             
-            # エラー記録
-            self.supabase.table("tasks").update({
-                "status": "failed",
-                "error_message": str(e),
-                "retry_count": task.get("retry_count", 0) + 1,
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", task_id).execute()
+            # 送信していないので送信枠を返却
+            self.rate_limiter.release_task(task)
             
-            self.log_action(task_id, "task_failed", {
-                "error": str(e)
-            })
+            # エラー記録（retry_countの加算・max_retries到達時のdead_letterはcomplete_task側）
+            # 再試行はバックオフ後の予約時刻まで延期し、その間このワーカーは他のタスクを処理する
+            self.finish_task(
+                task_id, "failed",
+                error_message=str(e),
+                details={"error": str(e)},
+                scheduled_at=None if isinstance(e, PermanentTaskError) else self.task_queue.retry_at(task.get("retry_count") or 0)
+            )
             
             return False
     
-    def log_action(self, task_id: str, action: str, details: Dict):
-        """実行ログを記録"""
+    def finish_task(self, task_id: str, status: str, result: Optional[Dict] = None,
+                    error_message: Optional[str] = None, details: Optional[Dict] = None,
+                    scheduled_at: Optional[str] = None):
+        """タスク完了処理（アウトボックスに記録し、ステータス・実行ログ・日次統計はバックグラウンドで一括更新）"""
         try:
-            self.supabase.table("execution_logs").insert({
-                "task_id": task_id,
-                "worker_id": self.worker_id,
-                "action": action,
-                "details": details
-            }).execute()
+            self.outbox.record(
+                task_id, status,
+                result=result,
+                error_message=error_message,
+                details=details,
+                scheduled_at=scheduled_at
+            )
         except Exception as e:
-            logger.error(f"Failed to log action: {e}")
+            logger.error(f"Failed to finish task {task_id}: {e}")
+    
+    def is_healthy(self) -> bool:
+        """ヘルスチェック（登録済みでメインループ稼働中かつハートビートタスクが生きているか）"""
+        return (self.running and self.worker_id is not None
+                and self.heartbeat_task is not None and not self.heartbeat_task.done())
+    
+    async def realtime_token(self) -> Optional[str]:
+        """Realtime用のアクセストークン（期限が近ければ更新されたもの）"""
+        session = await self.db.call(self.supabase.auth.get_session)
+        if session:
+            self.access_token = session.access_token
+        return self.access_token
+    
+    def on_realtime_change(self, table: str, change_type: str, record: Dict, old_record: Dict):
+        """Realtime変更通知（取得可能なタスクの増加・予約の変更でメインループを起こす）"""
+        if table == "tasks" and change_type in ("INSERT", "UPDATE") and is_claimable(record):
+            self.claim_requested = True
+            # 他ワーカーのセッション待ちで取得できなかった場合に備え、猶予が切れる時刻にも取得し直す
+            self.scheduler.add_affinity_wake(record)
+            self.task_event.set()
+        if self.scheduler.on_change(table, change_type, record, old_record):
+            self.task_event.set()
+        self.accounts.on_change(table, change_type, record, old_record)
+    
+    async def wait_for_tasks(self):
+        """Realtime通知・次の予約時刻・ポーリング間隔のいずれかまで待機"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        
+        while self.running and not self.claim_requested:
+            # 購読が切れたら（on_disconnectで起こされる）通常のポーリング間隔に戻す
+            if self.realtime and self.realtime.connected:
+                deadline = started + self.fallback_poll_interval
+            else:
+                deadline = started + self.poll_interval
+            
+            # 先読み期間内の予約タスクを同期
+            if self.scheduler.needs_sync():
+                await self.scheduler.sync()
+            
+            # 予約時刻に達したタスクがあれば取得へ
+            if self.scheduler.pop_due():
+                return
+            
+            if loop.time() >= deadline:
+                return
+            
+            timeout = min(
+                deadline - loop.time(),
+                self.scheduler.seconds_until_next(),
+                self.scheduler.seconds_until_sync()
+            )
+            self.task_event.clear()
+            try:
+                await asyncio.wait_for(self.task_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    def log_action(self, task_id: str, action: str, details: Dict):
+        """実行ログを記録（バッファに追加し、LogSinkが一括書き込み）"""
+        self.log_sink.add({
+            "task_id": task_id,
+            "worker_id": self.worker_id,
+            "action": action,
+            "details": details
+        })
     
     async def cleanup(self):
         """クリーンアップ"""
         self.running = False
+        self.metrics.stop()
+        await self.metrics_server.stop()
         
-        # 全自動化インスタンスをクリーンアップ
-        for automation in self.automations.values():
-            await automation.cleanup()
+        # 全自動化インスタンスをクリーンアップ（次回起動時のためにセッションを保存）
+        await self.automations.close()
+        self.thread_cache.close()
+        
+        # 未送信の実行ログ・状態遷移を書き込み
+        await self.log_sink.close()
+        await self.outbox.close()
         
         # ワーカーをオフラインに
         if self.worker_id:
             try:
-                self.supabase.table("worker_connections").update({
+                await self.db.execute(self.db.table("worker_connections").update({
                     "status": "offline",
                     "last_heartbeat": datetime.utcnow().isoformat()
-                }).eq("id", self.worker_id).execute()
+                }).eq("id", self.worker_id))
             except:
                 pass
+            
+            # サインアウト（トークン自動更新タイマーが残るとプロセスが終了しない）
+            try:
+                await self.db.call(self.supabase.auth.sign_out)
+            except Exception as e:
+                logger.error(f"Sign out failed: {e}")
+        
+        self.db.close()
     
     async def run(self):
         """メインループ"""
         logger.info("Starting LocalWorker...")
+        await self.metrics_server.start()
+        # RSSサンプラーの値は/metricsでのみ使う（ブラウザの作り直し判定はプール側でRSSを直接測る）ため、
+        # METRICS_PORT未設定でメトリクスサーバーを起動しない場合はサンプリングもしない
+        if self.metrics_server.server:
+            self.metrics.start()
         
         # ワーカー登録
         if not await self.register_worker():
             logger.error("Failed to register worker")
             return
         
-        # ハートビートタスク開始
-        heartbeat_task = asyncio.create_task(self.heartbeat())
+        # ハートビート・ログ書き込み・状態遷移送信タスク開始
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        self.log_sink.start()
+        self.outbox.start()
+        
+        # 共有ブラウザの先行起動（登録・ハートビートを遅らせないよう既定はバックグラウンド）
+        prewarm_task = None
+        if self.automations.browser_launch == "eager":
+            await self.automations.prewarm()
+        elif self.automations.browser_launch == "background":
+            prewarm_task = asyncio.create_task(self.automations.prewarm())
+        
+        # Realtime購読開始
+        realtime_task = None
+        if self.realtime_enabled:
+            self.realtime = RealtimeListener(
+                self.supabase_url, self.supabase_key, ["tasks", "facebook_accounts"],
+                self.on_realtime_change, token_provider=self.realtime_token,
+                on_disconnect=self.task_event.set
+            )
+            realtime_task = asyncio.create_task(self.realtime.run())
         
         try:
+            loop = asyncio.get_running_loop()
             while self.running:
+                iteration_started = loop.time()
+                
                 # タスク取得
+                self.claim_requested = False
                 tasks = await self.fetch_pending_tasks()
                 
                 if tasks:
@@ -253,21 +394,34 @@ class LocalWorker:
                     # タスクを順次処理（並列処理も可能）
                     for task in tasks:
                         logger.info(f"Processing task: {task['id']}")
-                        await self.process_task(task)
+                        with tracer.task(task["id"]), tracer.span("process_task"):
+                            await self.process_task(task)
                         
                         # 次のタスクまで少し待機
                         await asyncio.sleep(2)
+                    
+                    # 残りのタスクがないか続けて確認
+                    LOOP_ITERATION.observe(loop.time() - iteration_started)
+                    continue
+                
+                LOOP_ITERATION.observe(loop.time() - iteration_started)
                 
-                # 次のポーリングまで待機
-                await asyncio.sleep(10)
+                # 次の通知またはポーリングまで待機
+                await self.wait_for_tasks()
                 
         except KeyboardInterrupt:
             logger.info("Shutting down...")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
         finally:
+            if self.realtime:
+                self.realtime.stop()
+            if realtime_task:
+                realtime_task.cancel()
+            if prewarm_task:
+                prewarm_task.cancel()
             await self.cleanup()
-            heartbeat_task.cancel()
+            self.heartbeat_task.cancel()
 
 
 async def main():
@@ -191,6 +191,9 @@ CREATE INDEX IF NOT EXISTS idx_worker_tasks_worker_id ON worker.tasks(worker_id)
 CREATE INDEX IF NOT EXISTS idx_worker_tasks_supabase_id ON worker.tasks(supabase_task_id);
 CREATE INDEX IF NOT EXISTS idx_worker_tasks_scheduled_at ON worker.tasks(scheduled_at);
 CREATE INDEX IF NOT EXISTS idx_worker_tasks_created_at ON worker.tasks(created_at);
+-- 取得待ちタスクを優先度→作成日時順に取り出すための部分インデックス
+CREATE INDEX IF NOT EXISTS idx_worker_tasks_dequeue ON worker.tasks(priority, created_at)
+    WHERE status IN ('pending', 'retrying');
 
 CREATE INDEX IF NOT EXISTS idx_execution_logs_task_id ON worker.execution_logs(task_id);
 CREATE INDEX IF NOT EXISTS idx_execution_logs_logged_at ON worker.execution_logs(logged_at);
@@ -0,0 +1,507 @@
+-- Step 8: タスクキュー（ワーカー用RPC）
+
+-- ワーカー割り当て用カラム
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS worker_id UUID REFERENCES worker_connections(id) ON DELETE SET NULL;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS started_at TIMESTAMPTZ;
+
+-- リース期限（ワーカーのハートビートで延長され、切れた行はreap_expired_leasesで再キューされる）
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS leased_until TIMESTAMPTZ;
+
+-- 再試行の上限（超えた失敗はdead_letterに移す）
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS max_retries INT NOT NULL DEFAULT 3;
+
+-- 優先度（1が最高、message_tasks.priorityと同じ1-10）とエージング用の最終昇格時刻
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS priority INT NOT NULL DEFAULT 5;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS aged_at TIMESTAMPTZ;
+
+-- 送信枠を確保した日（reserve_send_quota。処理中の間だけ当日の送信数に数える）
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS quota_date DATE;
+
+-- ステップ計測（sql/render_worker_schema.sql の worker.execution_logs と同じカラム）
+ALTER TABLE execution_logs ADD COLUMN IF NOT EXISTS step_name TEXT;
+ALTER TABLE execution_logs ADD COLUMN IF NOT EXISTS step_order INT;
+ALTER TABLE execution_logs ADD COLUMN IF NOT EXISTS execution_time_ms INT;
+ALTER TABLE execution_logs ADD COLUMN IF NOT EXISTS memory_usage_mb DECIMAL(10, 2);
+
+-- ユーザーのトークンで接続するlocal-workerが自分のタスクの実行ログ・ステップ計測を書き込めるようにする
+DROP POLICY IF EXISTS "Users can insert own logs" ON execution_logs;
+CREATE POLICY "Users can insert own logs" ON execution_logs
+    FOR INSERT WITH CHECK (
+        task_id IN (SELECT id FROM tasks WHERE user_id = auth.uid())
+        AND (worker_id IS NULL OR worker_id IN (SELECT id FROM worker_connections WHERE user_id = auth.uid()))
+    );
+
+-- アカウント更新をワーカーのキャッシュ破棄に使うためRealtime対象に追加
+ALTER PUBLICATION supabase_realtime ADD TABLE facebook_accounts;
+
+-- 取得待ちタスク用の部分インデックス（claim_tasksのORDER BYと同じ並び）
+DROP INDEX IF EXISTS idx_tasks_claimable;
+CREATE INDEX IF NOT EXISTS idx_tasks_claimable ON tasks(priority, created_at)
+    WHERE status IN ('pending', 'retry');
+
+-- セッション保持中アカウントのタスクを先に取得するための部分インデックス（claim_tasks）
+CREATE INDEX IF NOT EXISTS idx_tasks_claimable_account ON tasks(account_id, priority, created_at)
+    WHERE status IN ('pending', 'retry');
+
+-- リース切れ検出用の部分インデックス
+CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks(leased_until)
+    WHERE status = 'processing';
+
+-- 送信枠の確保済み件数の集計用の部分インデックス（reserve_send_quota）
+CREATE INDEX IF NOT EXISTS idx_tasks_quota ON tasks(account_id, quota_date)
+    WHERE status = 'processing';
+
+-- タスクの原子的な取得（複数ワーカーでも同じタスクを二重取得しない）
+-- FOR UPDATE SKIP LOCKED で他ワーカーがロック中の行を飛ばし、
+-- 1回のリクエストで最大 p_limit 件を processing に更新して返す
+-- p_exclude_accounts: ワーカー側で送信上限に達したアカウント（取得しない）
+-- p_lease_seconds: リース期間（この間にハートビートで延長されなければ再キュー対象）
+-- p_warm_accounts: このワーカーがセッションを保持しているアカウント（最高優先度のうちこれらを先に取得し、
+--   残りを通常の優先度→作成日時順で埋める。どちらもインデックス順に読むだけで全件ソートはしない）
+-- p_affinity_grace_seconds: 他のワーカーがセッションを保持しているアカウントのタスクは、
+--   取得可能になってからこの秒数はそのワーカーに任せて取得しない（ログイン・ブラウザ起動の削減）。
+--   猶予が切れる時刻にはワーカー側のスケジューラーが取得し直す（scheduler.add_affinity_wake）
+DROP FUNCTION IF EXISTS public.claim_tasks(UUID, INT);
+DROP FUNCTION IF EXISTS public.claim_tasks(UUID, INT, UUID[]);
+DROP FUNCTION IF EXISTS public.claim_tasks(UUID, INT, UUID[], INT);
+CREATE OR REPLACE FUNCTION public.claim_tasks(
+    p_worker_id UUID,
+    p_limit INT DEFAULT 1,
+    p_exclude_accounts UUID[] DEFAULT '{}',
+    p_lease_seconds INT DEFAULT 120,
+    p_warm_accounts UUID[] DEFAULT '{}',
+    p_affinity_grace_seconds INT DEFAULT 30
+)
+RETURNS TABLE (
+    id UUID,
+    account_id UUID,
+    task_type TEXT,
+    recipient_name TEXT,
+    message TEXT,
+    retry_count INT,
+    created_at TIMESTAMPTZ
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_limit INT := GREATEST(p_limit, 1);
+    v_top INT;
+    v_ids UUID[] := '{}';
+BEGIN
+    -- 取得できるタスクの最高優先度（idx_tasks_claimableの先頭から読むので全件のソートはしない）
+    SELECT t.priority INTO v_top
+    FROM tasks t
+    WHERE t.status IN ('pending', 'retry')
+      AND (t.scheduled_at IS NULL OR t.scheduled_at <= NOW())
+      AND NOT (t.account_id = ANY(p_exclude_accounts))
+    ORDER BY t.priority, t.created_at
+    LIMIT 1;
+
+    IF v_top IS NULL THEN
+        RETURN;
+    END IF;
+
+    -- 同じ優先度のうちセッション保持中のアカウントのタスクを先に（idx_tasks_claimable_account）
+    IF cardinality(p_warm_accounts) > 0 THEN
+        SELECT COALESCE(array_agg(w.id), '{}') INTO v_ids
+        FROM (
+            SELECT t.id
+            FROM tasks t
+            WHERE t.status IN ('pending', 'retry')
+              AND t.account_id = ANY(p_warm_accounts)
+              AND t.priority = v_top
+              AND (t.scheduled_at IS NULL OR t.scheduled_at <= NOW())
+              AND NOT (t.account_id = ANY(p_exclude_accounts))
+            ORDER BY t.created_at
+            LIMIT v_limit
+            FOR UPDATE SKIP LOCKED
+        ) w;
+    END IF;
+
+    -- 残りは優先度→作成日時順（idx_tasks_claimableの並び）
+    IF cardinality(v_ids) < v_limit THEN
+        SELECT v_ids || COALESCE(array_agg(r.id), '{}') INTO v_ids
+        FROM (
+            SELECT t.id
+            FROM tasks t
+            WHERE t.status IN ('pending', 'retry')
+              AND (t.scheduled_at IS NULL OR t.scheduled_at <= NOW())
+              AND NOT (t.account_id = ANY(p_exclude_accounts))
+              AND NOT (t.id = ANY(v_ids))
+              AND (
+                  t.account_id = ANY(p_warm_accounts)
+                  OR COALESCE(t.scheduled_at, t.created_at) <= NOW() - make_interval(secs => p_affinity_grace_seconds)
+                  OR NOT EXISTS (
+                      SELECT 1
+                      FROM worker_connections wc
+                      WHERE wc.id <> p_worker_id
+                        AND wc.status = 'online'
+                        AND wc.last_heartbeat >= NOW() - make_interval(secs => p_lease_seconds)
+                        AND wc.capabilities->'warm_accounts' ? t.account_id::TEXT
+                  )
+              )
+            ORDER BY t.priority, t.created_at
+            LIMIT v_limit - cardinality(v_ids)
+            FOR UPDATE SKIP LOCKED
+        ) r;
+    END IF;
+
+    RETURN QUERY
+    WITH claimed AS (
+        UPDATE tasks t
+        SET status = 'processing',
+            worker_id = p_worker_id,
+            started_at = NOW(),
+            leased_until = NOW() + make_interval(secs => p_lease_seconds),
+            updated_at = NOW()
+        WHERE t.id = ANY(v_ids)
+        RETURNING t.id, t.account_id, t.task_type, t.recipient_name, t.message, t.retry_count, t.created_at, t.priority
+    )
+    SELECT c.id, c.account_id, c.task_type, c.recipient_name, c.message, c.retry_count, c.created_at
+    FROM claimed c ORDER BY c.priority, c.created_at;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 優先度のエージング（低優先度タスクの飢餓防止）
+-- 取得可能になってから（予約・延期中は数えない）p_interval以上待たされているタスクの優先度を1段階上げる。
+-- 昇格は aged_at から p_interval ごとに1回だけなので、複数ワーカーが呼んでも二重に上がらない。
+-- 最高優先度（1）は新しい緊急タスク用に残し、エージングでは2までしか上げない
+-- （1タスクあたりの更新回数も既定の5から3回までに収まる）。
+-- updated_at = aged_at の行はワーカー側でRealtime通知を無視する（task_queue.is_claimable）
+CREATE OR REPLACE FUNCTION public.age_task_priorities(
+    p_interval INTERVAL DEFAULT INTERVAL '10 minutes'
+)
+RETURNS INT AS $$
+    WITH aged AS (
+        UPDATE tasks
+        SET priority = priority - 1,
+            aged_at = NOW(),
+            updated_at = NOW()
+        WHERE status IN ('pending', 'retry')
+          AND priority > 2
+          AND COALESCE(scheduled_at, created_at) <= NOW() - p_interval
+          AND (aged_at IS NULL OR aged_at <= NOW() - p_interval)
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INT FROM aged;
+$$ LANGUAGE sql;
+
+-- リース延長（ワーカーのハートビートを兼ねる）
+-- p_task_ids: ワーカープロセスが実際に保持しているタスク。worker_nameが同じため再起動後も
+-- worker_idは変わらないので、前のプロセスが残したタスクは延長せずリース切れで回収させる
+-- p_warm_accounts: セッションを保持しているアカウント（capabilities.warm_accountsに公開し、claim_tasksの振り分けに使う）
+DROP FUNCTION IF EXISTS public.extend_task_leases(UUID, UUID[], INT);
+CREATE OR REPLACE FUNCTION public.extend_task_leases(
+    p_worker_id UUID,
+    p_task_ids UUID[] DEFAULT '{}',
+    p_lease_seconds INT DEFAULT 120,
+    p_warm_accounts UUID[] DEFAULT NULL
+)
+RETURNS INT AS $$
+    UPDATE worker_connections
+    SET last_heartbeat = NOW(),
+        status = 'online',
+        capabilities = CASE
+            WHEN p_warm_accounts IS NULL THEN capabilities
+            ELSE jsonb_set(COALESCE(capabilities, '{}'::JSONB), '{warm_accounts}', to_jsonb(p_warm_accounts))
+        END
+    WHERE id = p_worker_id;
+
+    WITH extended AS (
+        UPDATE tasks
+        SET leased_until = NOW() + make_interval(secs => p_lease_seconds)
+        WHERE id = ANY(p_task_ids)
+          AND worker_id = p_worker_id
+          AND status = 'processing'
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INT FROM extended;
+$$ LANGUAGE sql;
+
+-- リース切れタスクの回収（どのワーカーが呼んでもよい）
+-- p_heartbeat_timeout以上ハートビートのないワーカーをofflineにし、
+-- リースが切れた処理中タスク（リース導入前の行は担当ワーカーが応答しないもの）を
+-- retry_countを増やしてretryに戻す（max_retriesに達していればdead_letter。ワーカーを落とし続けるタスク対策）。
+-- 他ワーカーが完了処理中の行はSKIP LOCKEDで飛ばす
+CREATE OR REPLACE FUNCTION public.reap_expired_leases(
+    p_heartbeat_timeout INTERVAL DEFAULT INTERVAL '2 minutes'
+)
+RETURNS JSONB AS $$
+    WITH silent AS (
+        UPDATE worker_connections
+        SET status = 'offline'
+        WHERE status = 'online'
+          AND last_heartbeat < NOW() - p_heartbeat_timeout
+        RETURNING id
+    ),
+    expired AS (
+        SELECT t.id
+        FROM tasks t
+        LEFT JOIN worker_connections w ON w.id = t.worker_id
+        WHERE t.status = 'processing'
+          AND (
+              t.leased_until < NOW()
+              OR (t.leased_until IS NULL
+                  AND (w.id IS NULL OR w.status = 'offline' OR w.last_heartbeat < NOW() - p_heartbeat_timeout))
+          )
+        FOR UPDATE OF t SKIP LOCKED
+    ),
+    requeued AS (
+        UPDATE tasks t
+        SET status = CASE WHEN t.retry_count >= t.max_retries THEN 'dead_letter' ELSE 'retry' END,
+            worker_id = NULL,
+            started_at = NULL,
+            leased_until = NULL,
+            retry_count = t.retry_count + 1,
+            updated_at = NOW()
+        FROM expired e
+        WHERE t.id = e.id
+        RETURNING t.id
+    )
+    SELECT jsonb_build_object(
+        'requeued', (SELECT COUNT(*) FROM requeued),
+        'offline', (SELECT COUNT(*) FROM silent)
+    );
+$$ LANGUAGE sql;
+
+-- ダッシュボード用集計テーブル（SUPABASE_TABLES_COMPLETE.sqlと同じ定義）
+CREATE TABLE IF NOT EXISTS daily_statistics (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    account_id UUID REFERENCES facebook_accounts(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    sent_count INTEGER DEFAULT 0,
+    delivered_count INTEGER DEFAULT 0,
+    read_count INTEGER DEFAULT 0,
+    failed_count INTEGER DEFAULT 0,
+    response_count INTEGER DEFAULT 0,
+    success_rate DECIMAL(5,2),
+    avg_delivery_time INTEGER,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(account_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS realtime_stats (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    total_messages_today INTEGER DEFAULT 0,
+    total_messages_week INTEGER DEFAULT 0,
+    total_messages_month INTEGER DEFAULT 0,
+    active_accounts INTEGER DEFAULT 0,
+    pending_tasks INTEGER DEFAULT 0,
+    processing_tasks INTEGER DEFAULT 0,
+    success_rate_today DECIMAL(5,2),
+    last_message_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO realtime_stats (id)
+SELECT gen_random_uuid() WHERE NOT EXISTS (SELECT 1 FROM realtime_stats);
+
+-- タスク完了処理（ステータス更新・実行ログ・日次統計を1トランザクションで実行）
+-- 既に処理済みのタスクは何もせずNULLを返す（再送しても二重集計しない）
+-- 失敗時は p_retry_at が指定されていれば retry として p_retry_at まで延期し（ワーカーは他のタスクを処理できる）、
+-- 再試行回数が max_retries に達していれば dead_letter に移す。p_retry_at がなければ再試行しない失敗（failed）。
+-- 戻り値は適用後のステータス（completed / retry / failed / dead_letter）
+DROP FUNCTION IF EXISTS public.complete_task(UUID, UUID, TEXT, JSONB, TEXT, JSONB);
+CREATE OR REPLACE FUNCTION public.complete_task(
+    p_task_id UUID,
+    p_worker_id UUID,
+    p_status TEXT,
+    p_result JSONB DEFAULT NULL,
+    p_error_message TEXT DEFAULT NULL,
+    p_log_details JSONB DEFAULT NULL,
+    p_retry_at TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS TEXT AS $$
+DECLARE
+    v_account_id UUID;
+    v_retry_count INT;
+    v_max_retries INT;
+    v_status TEXT;
+    v_sent INT := CASE WHEN p_status = 'completed' THEN 1 ELSE 0 END;
+BEGIN
+    IF p_status NOT IN ('completed', 'failed') THEN
+        RAISE EXCEPTION 'invalid task status: %', p_status;
+    END IF;
+
+    -- このワーカーがリース中のタスクのみ
+    SELECT account_id, retry_count, max_retries
+    INTO v_account_id, v_retry_count, v_max_retries
+    FROM tasks
+    WHERE id = p_task_id
+      AND worker_id = p_worker_id
+      AND status = 'processing'
+      AND (auth.role() = 'service_role' OR user_id = auth.uid())
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    v_status := CASE
+        WHEN p_status = 'completed' THEN 'completed'
+        WHEN p_retry_at IS NULL THEN 'failed'
+        WHEN v_retry_count >= v_max_retries THEN 'dead_letter'
+        ELSE 'retry'
+    END;
+
+    -- ステータス更新（retryはリースを解放して予約時刻まで取得対象外に）
+    UPDATE tasks
+    SET status = v_status,
+        result = p_result,
+        error_message = p_error_message,
+        retry_count = retry_count + (1 - v_sent),
+        scheduled_at = CASE WHEN v_status = 'retry' THEN p_retry_at ELSE scheduled_at END,
+        worker_id = CASE WHEN v_status = 'retry' THEN NULL ELSE worker_id END,
+        started_at = CASE WHEN v_status = 'retry' THEN NULL ELSE started_at END,
+        leased_until = NULL,
+        completed_at = CASE WHEN v_status = 'retry' THEN NULL ELSE NOW() END,
+        updated_at = NOW()
+    WHERE id = p_task_id;
+
+    -- 実行ログ
+    INSERT INTO execution_logs (task_id, worker_id, action, details)
+    VALUES (p_task_id, p_worker_id, 'task_' || v_status, p_log_details);
+
+    -- 再試行待ちはまだ結果が確定していないので集計しない
+    IF v_status = 'retry' THEN
+        RETURN v_status;
+    END IF;
+
+    -- アカウント別日次統計
+    INSERT INTO daily_statistics (account_id, date, sent_count, failed_count, success_rate)
+    VALUES (v_account_id, CURRENT_DATE, v_sent, 1 - v_sent, v_sent * 100)
+    ON CONFLICT (account_id, date) DO UPDATE
+    SET sent_count = daily_statistics.sent_count + EXCLUDED.sent_count,
+        failed_count = daily_statistics.failed_count + EXCLUDED.failed_count,
+        success_rate = ROUND(
+            (daily_statistics.sent_count + EXCLUDED.sent_count) * 100.0 /
+            (daily_statistics.sent_count + daily_statistics.failed_count + 1), 2
+        );
+
+    -- ダッシュボード用リアルタイム統計（日付が変わったら当日分をリセット）
+    UPDATE realtime_stats
+    SET total_messages_today = CASE WHEN updated_at::date = CURRENT_DATE THEN total_messages_today ELSE 0 END + v_sent,
+        success_rate_today = (
+            SELECT ROUND(SUM(sent_count) * 100.0 / NULLIF(SUM(sent_count + failed_count), 0), 2)
+            FROM daily_statistics
+            WHERE date = CURRENT_DATE
+        ),
+        last_message_at = CASE WHEN v_sent = 1 THEN NOW() ELSE last_message_at END,
+        updated_at = NOW()
+    WHERE id IS NOT NULL;
+
+    RETURN v_status;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- ワーカーのローカルアウトボックスに記録した状態遷移を一括適用
+-- p_items: [{seq, task_id, worker_id, status, result, error_message, details, scheduled_at}, ...]
+--   status = 'completed' / 'failed' → complete_task と同じ処理（failedのscheduled_atは再試行日時）
+--   status = 'deferred'            → pendingに戻して scheduled_at まで延期
+-- 適用済み・リース切れの遷移は applied = NULL（再送しても二重に適用しない）。
+-- 1件のエラーでバッチ全体を巻き戻さないよう、要素ごとに例外を捕捉して error に返す
+CREATE OR REPLACE FUNCTION public.apply_task_transitions(p_items JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_item JSONB;
+    v_applied TEXT;
+    v_results JSONB := '[]'::JSONB;
+BEGIN
+    FOR v_item IN SELECT * FROM jsonb_array_elements(p_items) LOOP
+        BEGIN
+            IF v_item->>'status' = 'deferred' THEN
+                UPDATE tasks
+                SET status = 'pending',
+                    scheduled_at = (v_item->>'scheduled_at')::TIMESTAMPTZ,
+                    worker_id = NULL,
+                    started_at = NULL,
+                    leased_until = NULL,
+                    updated_at = NOW()
+                WHERE id = (v_item->>'task_id')::UUID
+                  AND worker_id = (v_item->>'worker_id')::UUID
+                  AND status = 'processing'
+                  AND (auth.role() = 'service_role' OR user_id = auth.uid());
+                v_applied := CASE WHEN FOUND THEN 'deferred' END;
+            ELSE
+                v_applied := complete_task(
+                    (v_item->>'task_id')::UUID,
+                    (v_item->>'worker_id')::UUID,
+                    v_item->>'status',
+                    NULLIF(v_item->'result', 'null'::JSONB),
+                    v_item->>'error_message',
+                    NULLIF(v_item->'details', 'null'::JSONB),
+                    (v_item->>'scheduled_at')::TIMESTAMPTZ
+                );
+            END IF;
+            v_results := v_results || jsonb_build_object('seq', v_item->'seq', 'applied', v_applied);
+        EXCEPTION WHEN OTHERS THEN
+            v_results := v_results || jsonb_build_object('seq', v_item->'seq', 'error', SQLERRM);
+        END;
+    END LOOP;
+
+    RETURN v_results;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- 送信枠の原子的な確保（facebook_accounts.daily_limitを全ワーカー合計で超えない）
+-- アカウント行をFOR UPDATEでロックして同じアカウントの確保を直列化し、
+-- 当日の送信済み件数（daily_statistics.sent_count）と枠を確保して処理中のタスク数の合計が
+-- daily_limit未満のときだけタスクにquota_dateを記録してTRUEを返す（上限到達はFALSE）。
+-- 完了したタスクはcomplete_taskで同じトランザクション内にsent_countへ移り、
+-- 失敗・延期・リース切れのタスクは処理中でなくなるので、枠の返却は不要
+-- このワーカーがリース中のタスクでなければNULL（処理しない）
+CREATE OR REPLACE FUNCTION public.reserve_send_quota(
+    p_task_id UUID,
+    p_worker_id UUID
+)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_account_id UUID;
+    v_limit INT;
+    v_used INT;
+BEGIN
+    SELECT account_id
+    INTO v_account_id
+    FROM tasks
+    WHERE id = p_task_id
+      AND worker_id = p_worker_id
+      AND status = 'processing'
+      AND (auth.role() = 'service_role' OR user_id = auth.uid())
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT daily_limit
+    INTO v_limit
+    FROM facebook_accounts
+    WHERE id = v_account_id
+    FOR UPDATE;
+
+    IF v_limit IS NOT NULL THEN
+        SELECT COALESCE((
+                   SELECT sent_count
+                   FROM daily_statistics
+                   WHERE account_id = v_account_id
+                     AND date = CURRENT_DATE
+               ), 0)
+             + (SELECT COUNT(*)
+                FROM tasks
+                WHERE account_id = v_account_id
+                  AND status = 'processing'
+                  AND quota_date = CURRENT_DATE
+                  AND id <> p_task_id)
+        INTO v_used;
+
+        IF v_used >= v_limit THEN
+            RETURN FALSE;
+        END IF;
+    END IF;
+
+    UPDATE tasks
+    SET quota_date = CURRENT_DATE
+    WHERE id = p_task_id;
+
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
@@ -0,0 +1,64 @@
+"""
+アカウントキャッシュモジュール
+facebook_accountsの必要カラムと復号済みパスワードをメモリ上にTTL付きで保持
+"""
+
+import logging
+import os
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from cryptography.fernet import Fernet
+
+logger = logging.getLogger(__name__)
+
+# タスク実行に必要なカラムのみ取得
+ACCOUNT_COLUMNS = 'id,email,encrypted_password,status,daily_limit'
+
+class AccountCache:
+    def __init__(self, db, cipher: Fernet):
+        self.db = db
+        self.cipher = cipher
+        self.ttl = float(os.getenv('ACCOUNT_CACHE_TTL', '300'))
+
+        # account_id -> (有効期限, アカウント情報)  ※ディスクには書き出さない
+        self._entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    async def get(self, account_id: str) -> Dict[str, Any]:
+        """アカウント情報取得（キャッシュが有効ならDBにアクセスしない）"""
+        entry = self._entries.get(account_id)
+        if entry and time.monotonic() < entry[0]:
+            return entry[1]
+
+        result = await self.db.execute(
+            self.db.table('facebook_accounts').select(ACCOUNT_COLUMNS).eq('id', account_id).single()
+        )
+        row = result.data
+        if not row:
+            raise ValueError(f"アカウントが見つかりません: {account_id}")
+
+        account = {
+            'id': row['id'],
+            'email': row['email'],
+            'password': self.cipher.decrypt(row['encrypted_password'].encode()).decode(),
+            'status': row.get('status'),
+            'daily_limit': row.get('daily_limit')
+        }
+        self._entries[account_id] = (time.monotonic() + self.ttl, account)
+        return account
+
+    def invalidate(self, account_id: Optional[str] = None):
+        """キャッシュ破棄（account_id省略時は全件）"""
+        if account_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(account_id, None)
+
+    def on_change(self, table: str, change_type: str, record: Dict[str, Any], old_record: Dict[str, Any]):
+        """Realtime変更通知（facebook_accountsの更新・削除でキャッシュ破棄）"""
+        if table != 'facebook_accounts':
+            return
+        account_id = record.get('id') or old_record.get('id')
+        if account_id:
+            self.invalidate(account_id)
+            logger.debug(f"アカウントキャッシュ破棄: {account_id}")
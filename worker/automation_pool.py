@@ -0,0 +1,184 @@
+"""
+ブラウザ自動化プールモジュール
+アカウントごとのFacebookAutomationを上限付きLRUで保持し、追い出し時はセッションを保存して閉じる
+（Playwrightは最初のブラウザ起動時に読み込み、ワーカーの起動を遅らせない）
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, List
+
+from browser_watchdog import BrowserWatchdog
+from session_store import SessionStore
+from thread_cache import ThreadCache
+from system_metrics import chromium_tree_rss, MB
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser
+    from facebook_automation import FacebookAutomation
+
+logger = logging.getLogger(__name__)
+
+class AutomationPool:
+    def __init__(self, sessions: SessionStore, thread_cache: Optional[ThreadCache] = None):
+        self.sessions = sessions
+        self.thread_cache = thread_cache
+
+        # 設定
+        self.max_instances = int(os.getenv('BROWSER_POOL_SIZE', '3'))
+        self.max_rss_mb = float(os.getenv('BROWSER_POOL_MAX_RSS_MB', '0'))  # 0は無制限
+        self.shared_browser = os.getenv('SHARED_BROWSER', 'true').lower() == 'true'
+        self.headless = os.getenv('HEADLESS', 'true').lower() == 'true'
+        # ブラウザ起動タイミング（eager: 起動時に待つ / background: 登録後に裏で起動 / lazy: 最初のタスクで起動）
+        self.browser_launch = os.getenv('BROWSER_LAUNCH', 'background').lower()
+
+        # account_id -> FacebookAutomation（末尾が最近使用）
+        self.automations: "OrderedDict[str, FacebookAutomation]" = OrderedDict()
+
+        # クラッシュ検出・コンテキストの定期的な作り直し
+        self.watchdog = BrowserWatchdog()
+
+        # 共有ブラウザ（SHARED_BROWSER=true時は1プロセスに複数コンテキスト）
+        self.playwright = None
+        self.browser: Optional['Browser'] = None
+        self._browser_lock = asyncio.Lock()
+
+    def __contains__(self, account_id: str) -> bool:
+        return account_id in self.automations
+
+    def __len__(self) -> int:
+        return len(self.automations)
+
+    def warm_accounts(self) -> List[str]:
+        """ブラウザコンテキスト（セッション）を保持しているアカウント"""
+        return list(self.automations)
+
+    async def acquire(self, account_id: str, email: str) -> 'FacebookAutomation':
+        """アカウントの自動化インスタンスを取得（なければ保存済みセッションから作成）"""
+        automation = self.automations.get(account_id)
+        if automation:
+            self.automations.move_to_end(account_id)
+            try:
+                # タスクの合間にクラッシュ復旧・コンテキストの作り直し
+                # 共有ブラウザのみChromium全体を起動し直せる（個別ブラウザでは他アカウントの分のRSSが残る）
+                await self.watchdog.check(
+                    automation,
+                    lambda: self.sessions.load(account_id),
+                    self._get_shared_browser if self.shared_browser else None,
+                    (lambda: self._restart_shared_browser(account_id)) if self.shared_browser else None
+                )
+                return automation
+            except Exception as e:
+                # 復旧できなければ破棄して新しく作る
+                logger.error(f"ブラウザ復旧エラー {email}: {str(e)}")
+                self.automations.pop(account_id, None)
+                await automation.cleanup()
+
+        await self._make_room()
+
+        from facebook_automation import FacebookAutomation
+        automation = FacebookAutomation(self.thread_cache)
+        await automation.initialize(
+            storage_state=self.sessions.load(account_id),
+            user=email,
+            browser=await self._get_shared_browser() if self.shared_browser else None
+        )
+        self.automations[account_id] = automation
+        logger.info(f"ブラウザプール追加: {email} ({len(self.automations)}/{self.max_instances})")
+        return automation
+
+    async def _get_shared_browser(self) -> 'Browser':
+        """共有ブラウザ取得（未起動・切断時は起動。先行起動と同時に呼ばれても1回だけ起動）"""
+        async with self._browser_lock:
+            if self.browser and self.browser.is_connected():
+                return self.browser
+
+            from playwright.async_api import async_playwright
+            from facebook_automation import launch_browser
+
+            if not self.playwright:
+                self.playwright = await async_playwright().start()
+            self.browser = await launch_browser(self.playwright, self.headless)
+            return self.browser
+
+    async def _restart_shared_browser(self, account_id: str):
+        """全アカウントのセッションを保存して共有ブラウザを起動し直す（他のアカウントは次回取得時にクラッシュとして復元）"""
+        for other_id, automation in self.automations.items():
+            if automation.logged_in and automation.is_alive():
+                try:
+                    self.sessions.save(other_id, await automation.export_session())
+                except Exception as e:
+                    logger.error(f"セッション保存エラー {other_id}: {str(e)}")
+
+        async with self._browser_lock:
+            try:
+                if self.browser:
+                    await self.browser.close()
+            except Exception as e:
+                logger.error(f"共有ブラウザ終了エラー: {str(e)}")
+            self.browser = None
+
+        automation = self.automations[account_id]
+        await automation.restart(self.sessions.load(account_id), browser=await self._get_shared_browser())
+
+    async def prewarm(self):
+        """最初のタスクを待たずに共有ブラウザを起動しておく（バックグラウンド実行用）"""
+        if not self.shared_browser:
+            return
+        try:
+            await self._get_shared_browser()
+            logger.info("共有ブラウザを先行起動しました")
+        except Exception as e:
+            # 失敗しても最初のタスクで起動し直す
+            logger.error(f"共有ブラウザの先行起動エラー: {str(e)}")
+
+    def rss_mb(self) -> float:
+        """Chromiumプロセス全体のRSS(MB)"""
+        return chromium_tree_rss() / MB
+
+    async def _make_room(self):
+        """上限を超えないよう最も古く使われたアカウントを追い出す"""
+        while self.automations and len(self.automations) >= self.max_instances:
+            await self.evict_lru()
+
+        if self.max_rss_mb:
+            while self.automations and self.rss_mb() >= self.max_rss_mb:
+                await self.evict_lru()
+
+    async def evict_lru(self):
+        """最も古く使われたアカウントを追い出す"""
+        account_id = next(iter(self.automations))
+        await self.evict(account_id)
+
+    async def evict(self, account_id: str):
+        """セッションを保存してブラウザ（コンテキスト）を閉じる"""
+        automation = self.automations.pop(account_id, None)
+        if not automation:
+            return
+
+        if automation.logged_in:
+            try:
+                self.sessions.save(account_id, await automation.export_session())
+            except Exception as e:
+                logger.error(f"セッション保存エラー {account_id}: {str(e)}")
+
+        await automation.cleanup()
+        logger.info(f"ブラウザプールから追い出し: {automation.current_user}")
+
+    async def close(self):
+        """全インスタンスを保存して終了"""
+        for account_id in list(self.automations):
+            await self.evict(account_id)
+
+        try:
+            if self.browser:
+                await self.browser.close()
+            if self.playwright:
+                await self.playwright.stop()
+        except Exception as e:
+            logger.error(f"共有ブラウザ終了エラー: {str(e)}")
+        finally:
+            self.browser = None
+            self.playwright = None
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+ワーカーのオフラインベンチマーク
+疑似Supabaseバックエンド（fake_backend.py）とスタブページ（stub_pages.py）に対して
+local-worker/worker.pyのLocalWorkerを実行し、スループット・キュー投入から処理開始までの待ち時間・
+1タスクあたりのDB往復数・ピークRSSを出力する（Supabase・Facebookへは一切接続しない）
+
+使い方:
+    python worker/benchmarks/bench.py --tasks 50 --latency-ms 20
+    python worker/benchmarks/bench.py --json after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Callable, List, Dict, Any
+
+BENCH_DIR = Path(__file__).resolve().parent
+WORKER_DIR = BENCH_DIR.parent
+REPO_DIR = WORKER_DIR.parent
+sys.path.append(str(WORKER_DIR))
+sys.path.append(str(BENCH_DIR))
+
+import psutil
+from cryptography.fernet import Fernet
+
+from fake_backend import FakeBackend, ANON_KEY
+from system_metrics import chromium_tree_rss, MB
+
+logger = logging.getLogger('benchmark')
+
+# 結果が確定したステータス
+TERMINAL_STATUSES = ('completed', 'failed', 'dead_letter')
+
+def configure_environment(backend: FakeBackend, workdir: str, max_concurrent: int) -> bytes:
+    """ワーカーの接続先をすべてローカルに向ける（チューニング用の環境変数は上書きしない）"""
+    encryption_key = Fernet.generate_key()
+    os.environ.update({
+        'SUPABASE_URL': backend.url,
+        'SUPABASE_ANON_KEY': ANON_KEY,
+        'WORKER_EMAIL': 'worker@example.com',
+        'WORKER_PASSWORD': 'benchmark',
+        'ENCRYPTION_KEY': encryption_key.decode(),
+        'FACEBOOK_URL': backend.facebook_url,
+        'MESSENGER_URL': backend.messenger_url,
+        'REALTIME_ENABLED': 'false',
+        'SESSION_DIR': os.path.join(workdir, 'sessions'),
+        'OUTBOX_PATH': os.path.join(workdir, 'outbox.db'),
+        'THREAD_CACHE_PATH': os.path.join(workdir, 'thread_cache.db'),
+    })
+    os.environ.setdefault('HEADLESS', 'true')
+    os.environ.setdefault('MAX_CONCURRENT', str(max_concurrent))
+    return encryption_key
+
+def load_local_worker():
+    """local-worker/worker.pyをモジュールとして読み込む（ディレクトリ名にハイフンを含むため）"""
+    spec = importlib.util.spec_from_file_location('local_worker', REPO_DIR / 'local-worker' / 'worker.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed_accounts(backend: FakeBackend, cipher: Fernet, account_count: int) -> List[str]:
+    """アカウントを投入してアカウントIDを返す"""
+    return [
+        backend.insert('facebook_accounts', {
+            'user_id': backend.user_id,
+            'email': f'bench{i}@example.com',
+            'encrypted_password': cipher.encrypt(b'password').decode(),
+            'status': 'active',
+            'daily_limit': None
+        })['id']
+        for i in range(account_count)
+    ]
+
+def seed_tasks(backend: FakeBackend, account_ids: List[str], task_count: int, start: int = 0,
+               max_retries: int = 3) -> List[str]:
+    """アカウントに順番に割り振ってタスクを投入し、タスクIDを返す（メッセージは通し番号で一意）"""
+    return [
+        backend.insert('tasks', {
+            'user_id': backend.user_id,
+            'account_id': account_ids[i % len(account_ids)],
+            'task_type': 'send_message',
+            'recipient_name': f'Bench Recipient {i}',
+            'message': f'benchmark message {i}',
+            'max_retries': max_retries
+        })['id']
+        for i in range(start, start + task_count)
+    ]
+
+class RssMonitor:
+    """ワーカープロセスとChromium子プロセスのRSSをサンプリングしてピークを保持"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.samples: List[tuple] = []
+        self.peak_worker = 0
+        self.peak_chromium = 0
+        self.peak_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self):
+        worker = self.process.memory_info().rss
+        chromium = chromium_tree_rss(self.process)
+        self.samples.append((time.monotonic(), worker, chromium))
+        self.peak_worker = max(self.peak_worker, worker)
+        self.peak_chromium = max(self.peak_chromium, chromium)
+        self.peak_total = max(self.peak_total, worker + chromium)
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+            except psutil.Error:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def terminal(backend: FakeBackend, task_ids: List[str]) -> bool:
+    """すべてのタスクが完了・失敗（再試行待ちを除く）になったか"""
+    ids = set(task_ids)
+    return all(row['status'] in TERMINAL_STATUSES for row in backend.rows('tasks') if row['id'] in ids)
+
+async def stop_worker(worker, run_task: asyncio.Task, timeout: float = 60):
+    """メインループを止めてcleanup（セッション保存・アウトボックス送信）まで待つ"""
+    worker.running = False
+    worker.task_event.set()
+    try:
+        await asyncio.wait_for(run_task, timeout=timeout)
+    except asyncio.TimeoutError:
+        run_task.cancel()
+
+async def run_until(worker, condition: Callable[[], bool], timeout: float, poll: float = 0.2) -> asyncio.Task:
+    """ワーカーを起動し、条件を満たすかタイムアウトするまで待つ"""
+    run_task = asyncio.create_task(worker.run())
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not run_task.done() and not condition():
+        await asyncio.sleep(poll)
+    return run_task
+
+def summarize(backend: FakeBackend, task_ids: List[str], duration: float, rss: RssMonitor) -> Dict[str, Any]:
+    ids = set(task_ids)
+    tasks = [row for row in backend.rows('tasks') if row['id'] in ids]
+    completed = [row for row in tasks if row['status'] == 'completed']
+    failed = [row for row in tasks if row['status'] in ('failed', 'dead_letter')]
+
+    waits = [
+        (parse_time(row['started_at']) - parse_time(row['created_at'])).total_seconds() * 1000
+        for row in tasks if row.get('started_at')
+    ]
+    round_trips = backend.round_trips()
+
+    return {
+        'tasks': len(tasks),
+        'completed': len(completed),
+        'failed': len(failed),
+        'unfinished': len(tasks) - len(completed) - len(failed),
+        'messages_delivered': len(backend.sent_messages),
+        'duration_s': round(duration, 2),
+        'tasks_per_min': round(len(completed) / duration * 60, 2) if duration else 0,
+        'enqueue_to_start_ms': {
+            'p50': round(percentile(waits, 50) or 0, 1),
+            'p95': round(percentile(waits, 95) or 0, 1),
+            'max': round(max(waits), 1) if waits else 0
+        },
+        'db_round_trips': round_trips,
+        'db_round_trips_per_task': round(round_trips / len(tasks), 2) if tasks else 0,
+        'round_trips_by_endpoint': dict(sorted(
+            (key, count) for key, count in backend.request_counts.items() if not key.startswith('stub')
+        )),
+        'peak_rss_mb': {
+            'worker': round(rss.peak_worker / MB, 1),
+            'chromium': round(rss.peak_chromium / MB, 1),
+            'total': round(rss.peak_total / MB, 1)
+        }
+    }
+
+async def benchmark(args) -> Dict[str, Any]:
+    backend = FakeBackend(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    backend.start()
+
+    with tempfile.TemporaryDirectory(prefix='worker-bench-') as workdir:
+        cipher = Fernet(configure_environment(backend, workdir, args.max_concurrent))
+        module = load_local_worker()
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+        # スループット計測なので失敗は再試行せず確定させる（再試行はsoak.pyで確認）
+        task_ids = seed_tasks(backend, seed_accounts(backend, cipher, args.accounts), args.tasks, max_retries=0)
+        worker = module.LocalWorker(backend.url, ANON_KEY, '')
+
+        rss = RssMonitor()
+        rss.start()
+        started = time.monotonic()
+        run_task = await run_until(worker, lambda: terminal(backend, task_ids), args.timeout)
+        duration = time.monotonic() - started
+        await stop_worker(worker, run_task)
+        rss.stop()
+
+        report = summarize(backend, task_ids, duration, rss)
+        report['config'] = {
+            'tasks': args.tasks, 'accounts': args.accounts, 'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms, 'max_concurrent': int(os.environ['MAX_CONCURRENT'])
+        }
+
+    backend.stop()
+    return report
+
+def _lookup(report: Dict[str, Any], path: str):
+    value = report
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    rows = [
+        ('tasks_per_min', 'tasks/min'),
+        ('enqueue_to_start_ms.p50', 'enqueue→start p50 (ms)'),
+        ('enqueue_to_start_ms.p95', 'enqueue→start p95 (ms)'),
+        ('db_round_trips_per_task', 'DB round-trips / task'),
+        ('peak_rss_mb.total', 'peak RSS total (MB)'),
+        ('peak_rss_mb.chromium', 'peak RSS chromium (MB)'),
+        ('duration_s', 'duration (s)'),
+    ]
+    print(f"\ntasks: {report['tasks']}  completed: {report['completed']}  failed: {report['failed']}  "
+          f"unfinished: {report['unfinished']}  delivered: {report['messages_delivered']}")
+    for path, label in rows:
+        value = _lookup(report, path)
+        line = f'  {label:<28} {value}'
+        if baseline and _lookup(baseline, path):
+            before = _lookup(baseline, path)
+            change = (value - before) / before * 100
+            # tasks/min以外は小さいほど良い
+            worse = change < 0 if path == 'tasks_per_min' else change > 0
+            line += f'   (baseline {before}, {change:+.1f}%{" ⚠" if worse and abs(change) >= 10 else ""})'
+        print(line)
+    print('  round-trips by endpoint:')
+    for key, count in report['round_trips_by_endpoint'].items():
+        print(f'    {key:<50} {count}')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='LocalWorkerのオフラインベンチマーク')
+    parser.add_argument('--tasks', type=int, default=20, help='投入するタスク数')
+    parser.add_argument('--accounts', type=int, default=1, help='タスクを割り振るアカウント数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='DBリクエストごとに注入するレイテンシ')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='レイテンシに加えるランダムな揺らぎ（最大値）')
+    parser.add_argument('--max-concurrent', type=int, default=3, help='1回に取得するタスク数（MAX_CONCURRENT）')
+    parser.add_argument('--timeout', type=float, default=900, help='全タスク完了を待つ最大秒数')
+    parser.add_argument('--json', help='結果をJSONで保存するパス')
+    parser.add_argument('--compare', help='比較対象の過去の結果JSON')
+    parser.add_argument('--verbose', action='store_true', help='ワーカーのログを表示')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    report = asyncio.run(benchmark(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return 0 if report['completed'] == report['tasks'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
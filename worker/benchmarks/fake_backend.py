@@ -0,0 +1,478 @@
+"""
+ベンチマーク用の疑似Supabaseバックエンド
+ワーカーが使うPostgRESTエンドポイント（tasks・worker_connections・execution_logs・facebook_accounts等）と
+RPC（claim_tasks・apply_task_transitions・age_task_priorities・extend_task_leases・reap_expired_leases）、パスワード認証をメモリ上で再現し、
+Facebook/Messengerのセレクタを模したスタブページも同じサーバーから配信する
+"""
+
+import base64
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Callable, List, Dict, Any
+from urllib.parse import urlsplit, parse_qsl
+
+from stub_pages import render_stub
+
+logger = logging.getLogger(__name__)
+
+# フィルタとして扱わないクエリパラメータ
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+# 行追加時の既定値
+TABLE_DEFAULTS = {
+    'tasks': {'status': 'pending', 'priority': 5, 'retry_count': 0, 'max_retries': 3, 'scheduled_at': None,
+              'worker_id': None},
+    'worker_connections': {'status': 'offline'},
+}
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _coerce(value: Any) -> Any:
+    """比較用に数値・タイムスタンプへ変換（変換できなければ文字列のまま）"""
+    if isinstance(value, (int, float)) or value is None:
+        return value
+    text = str(value)
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return text
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    """PostgRESTの演算子フィルタ（eq/neq/gt/gte/lt/lte/in/is）を評価"""
+    operator, _, argument = expression.partition('.')
+    value = row.get(column)
+
+    if operator == 'is':
+        return value is None if argument == 'null' else str(value).lower() == argument
+    if operator == 'in':
+        items = [item.strip().strip('"') for item in argument.strip('()').split(',') if item.strip()]
+        return str(value) in items
+    if value is None:
+        return False
+    if operator == 'eq':
+        return str(value) == argument or _coerce(value) == _coerce(argument)
+    if operator == 'neq':
+        return not (str(value) == argument or _coerce(value) == _coerce(argument))
+
+    left, right = _coerce(value), _coerce(argument)
+    try:
+        return {
+            'gt': lambda: left > right,
+            'gte': lambda: left >= right,
+            'lt': lambda: left < right,
+            'lte': lambda: left <= right,
+        }[operator]()
+    except (KeyError, TypeError):
+        return False
+
+def _fake_jwt(subject: str) -> str:
+    """署名なしのJWT形式トークン（クライアント側の形式チェック用）"""
+    def encode(data: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    payload = {'sub': subject, 'role': 'authenticated', 'exp': int(time.time()) + 3600}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(payload)}.signature"
+
+ANON_KEY = _fake_jwt('anon')
+
+class FakeBackend:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        # 注入するレイテンシ（秒、REST・認証リクエストごと）
+        self.latency = latency
+        self.jitter = jitter
+
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.lock = threading.RLock()
+
+        # 計測
+        self.request_counts: Dict[str, int] = {}
+        self.sent_messages: List[Dict[str, Any]] = []
+
+        # 障害注入フック（スタブページを含む全リクエストで呼ばれる。
+        # Noneを返せば通常処理、(status, body)を返せばその応答を返す。フック内で待てば応答遅延になる）
+        self.fault_hook: Optional[Callable[[str, str], Optional[tuple]]] = None
+
+        self.user_id = str(uuid.uuid4())
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def facebook_url(self) -> str:
+        return f'{self.url}/stub/facebook'
+
+    @property
+    def messenger_url(self) -> str:
+        return f'{self.url}/stub/messenger'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-backend', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---- データ操作 ----
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            record = {'id': str(uuid.uuid4()), 'created_at': now_iso(), 'updated_at': now_iso()}
+            record.update(TABLE_DEFAULTS.get(table, {}))
+            record.update(row)
+            self.tables.setdefault(table, []).append(record)
+            return record
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def round_trips(self) -> int:
+        """ワーカーからのREST・RPC・認証リクエスト数（スタブページは含まない）"""
+        return sum(count for key, count in self.request_counts.items() if not key.startswith('stub'))
+
+    def _select(self, table: str, params: List[tuple]) -> List[Dict[str, Any]]:
+        rows = self.tables.get(table, [])
+        for column, expression in params:
+            if column not in RESERVED_PARAMS:
+                rows = [row for row in rows if _matches(row, column, expression)]
+        return rows
+
+    def _project(self, rows: List[Dict[str, Any]], params: Dict[str, str]) -> List[Dict[str, Any]]:
+        for order in reversed(params.get('order', '').split(',') if params.get('order') else []):
+            column, _, direction = order.partition('.')
+            rows = sorted(rows, key=lambda row: (row.get(column) is None, _coerce(row.get(column))),
+                          reverse=direction.startswith('desc'))
+        if 'limit' in params:
+            rows = rows[int(params.get('offset', 0)):int(params.get('offset', 0)) + int(params['limit'])]
+
+        columns = params.get('select', '*')
+        if columns == '*':
+            return [dict(row) for row in rows]
+        names = [name.strip() for name in columns.split(',')]
+        return [{name: row.get(name) for name in names} for row in rows]
+
+    # ---- RPC（supabase/step8_task_queue.sqlと同じ振る舞い） ----
+
+    def rpc_claim_tasks(self, p_worker_id: str, p_limit: int = 1, p_exclude_accounts: Optional[List[str]] = None,
+                        p_lease_seconds: int = 120, p_warm_accounts: Optional[List[str]] = None,
+                        p_affinity_grace_seconds: int = 30):
+        now = datetime.now(timezone.utc)
+        excluded = set(p_exclude_accounts or [])
+        warm = set(p_warm_accounts or [])
+
+        # 他のオンラインワーカーがセッションを保持しているアカウント
+        heartbeat_threshold = now - timedelta(seconds=p_lease_seconds)
+        held_elsewhere = {
+            account_id
+            for worker in self.tables.get('worker_connections', [])
+            if worker['id'] != p_worker_id and worker.get('status') == 'online'
+            and worker.get('last_heartbeat') and _coerce(worker['last_heartbeat']) >= heartbeat_threshold
+            for account_id in (worker.get('capabilities') or {}).get('warm_accounts') or []
+        }
+        grace_threshold = now - timedelta(seconds=p_affinity_grace_seconds)
+
+        ready = [
+            task for task in self.tables.get('tasks', [])
+            if task['status'] in ('pending', 'retry')
+            and (task.get('scheduled_at') is None or _coerce(task['scheduled_at']) <= now)
+            and task.get('account_id') not in excluded
+        ]
+        ready.sort(key=lambda task: (task.get('priority', 5), _coerce(task['created_at'])))
+        if not ready:
+            return []
+
+        # 最高優先度のうちセッション保持中のアカウントを先に、残りを優先度→作成日時順で埋める
+        top = ready[0].get('priority', 5)
+        first = [task for task in ready if task.get('priority', 5) == top and task.get('account_id') in warm]
+        rest = [
+            task for task in ready
+            if task not in first
+            and (task.get('account_id') in warm or task.get('account_id') not in held_elsewhere
+                 or _coerce(task.get('scheduled_at') or task['created_at']) <= grace_threshold)
+        ]
+
+        claimed = []
+        for task in (first + rest)[:max(p_limit, 1)]:
+            task.update(status='processing', worker_id=p_worker_id, started_at=now_iso(), updated_at=now_iso(),
+                        leased_until=(now + timedelta(seconds=p_lease_seconds)).isoformat())
+            claimed.append({key: task.get(key) for key in (
+                'id', 'account_id', 'task_type', 'recipient_name', 'message', 'retry_count', 'created_at'
+            )})
+        return claimed
+
+    def rpc_age_task_priorities(self, p_interval: str = '600 seconds'):
+        seconds = float(str(p_interval).split()[0])
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        aged = 0
+        for task in self.tables.get('tasks', []):
+            if (task['status'] in ('pending', 'retry') and task.get('priority', 5) > 2
+                    and _coerce(task.get('scheduled_at') or task['created_at']) <= threshold
+                    and (not task.get('aged_at') or _coerce(task['aged_at']) <= threshold)):
+                task['priority'] -= 1
+                task['aged_at'] = task['updated_at'] = now_iso()
+                aged += 1
+        return aged
+
+    def rpc_extend_task_leases(self, p_worker_id: str, p_task_ids: Optional[List[str]] = None,
+                               p_lease_seconds: int = 120, p_warm_accounts: Optional[List[str]] = None):
+        for worker in self.tables.get('worker_connections', []):
+            if worker['id'] == p_worker_id:
+                worker.update(last_heartbeat=now_iso(), status='online')
+                if p_warm_accounts is not None:
+                    worker['capabilities'] = {**(worker.get('capabilities') or {}), 'warm_accounts': p_warm_accounts}
+        leased_until = (datetime.now(timezone.utc) + timedelta(seconds=p_lease_seconds)).isoformat()
+        extended = 0
+        for task in self.tables.get('tasks', []):
+            if (task['id'] in (p_task_ids or []) and task['status'] == 'processing'
+                    and task.get('worker_id') == p_worker_id):
+                task['leased_until'] = leased_until
+                extended += 1
+        return extended
+
+    def rpc_reap_expired_leases(self, p_heartbeat_timeout: str = '120 seconds'):
+        now = datetime.now(timezone.utc)
+        threshold = now - timedelta(seconds=float(str(p_heartbeat_timeout).split()[0]))
+        offline = 0
+        for worker in self.tables.get('worker_connections', []):
+            if worker.get('status') == 'online' and worker.get('last_heartbeat') \
+                    and _coerce(worker['last_heartbeat']) < threshold:
+                worker['status'] = 'offline'
+                offline += 1
+        requeued = 0
+        for task in self.tables.get('tasks', []):
+            if task['status'] == 'processing' and task.get('leased_until') and _coerce(task['leased_until']) < now:
+                task.update(status='dead_letter' if task.get('retry_count', 0) >= task.get('max_retries', 3) else 'retry',
+                            worker_id=None, started_at=None, leased_until=None,
+                            retry_count=task.get('retry_count', 0) + 1, updated_at=now_iso())
+                requeued += 1
+        return {'requeued': requeued, 'offline': offline}
+
+    def rpc_reserve_send_quota(self, p_task_id: str, p_worker_id: str):
+        task = self._leased_task({'task_id': p_task_id, 'worker_id': p_worker_id})
+        if not task:
+            return None
+        today = datetime.now(timezone.utc).date().isoformat()
+        account = next((row for row in self.tables.get('facebook_accounts', []) if row['id'] == task['account_id']), {})
+        if account.get('daily_limit') is not None:
+            # daily_statisticsの代わりに当日完了したタスクを数える
+            used = sum(
+                1 for row in self.tables.get('tasks', [])
+                if row['id'] != p_task_id and row.get('account_id') == task['account_id'] and (
+                    (row['status'] == 'completed' and (row.get('completed_at') or '').startswith(today))
+                    or (row['status'] == 'processing' and row.get('quota_date') == today)
+                )
+            )
+            if used >= account['daily_limit']:
+                return False
+        task['quota_date'] = today
+        return True
+
+    def _leased_task(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        for task in self.tables.get('tasks', []):
+            if task['id'] == item['task_id']:
+                if task['status'] == 'processing' and task.get('worker_id') == item['worker_id']:
+                    return task
+                return None
+        return None
+
+    def rpc_apply_task_transitions(self, p_items: List[Dict[str, Any]]):
+        results = []
+        for item in p_items:
+            task = self._leased_task(item)
+            applied = None
+            if task and item['status'] == 'deferred':
+                task.update(status='pending', scheduled_at=item.get('scheduled_at'), worker_id=None,
+                            started_at=None, leased_until=None, updated_at=now_iso())
+                applied = 'deferred'
+            elif task and item['status'] in ('completed', 'failed'):
+                failed = item['status'] == 'failed'
+                if not failed:
+                    status = 'completed'
+                elif not item.get('scheduled_at'):
+                    status = 'failed'
+                elif task.get('retry_count', 0) >= task.get('max_retries', 3):
+                    status = 'dead_letter'
+                else:
+                    status = 'retry'
+                retry = status == 'retry'
+                task.update(status=status, result=item.get('result'), error_message=item.get('error_message'),
+                            retry_count=task.get('retry_count', 0) + int(failed), leased_until=None,
+                            scheduled_at=item['scheduled_at'] if retry else task.get('scheduled_at'),
+                            worker_id=None if retry else task.get('worker_id'),
+                            started_at=None if retry else task.get('started_at'),
+                            completed_at=None if retry else now_iso(), updated_at=now_iso())
+                self.insert('execution_logs', {
+                    'task_id': task['id'], 'worker_id': item['worker_id'],
+                    'action': f'task_{status}', 'details': item.get('details')
+                })
+                applied = status
+            results.append({'seq': item.get('seq'), 'applied': applied})
+        return results
+
+    # ---- HTTP ----
+
+    def _handler_class(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status: int, body: Any = None, content_type: str = 'application/json',
+                      headers: Optional[Dict[str, str]] = None):
+                payload = body if isinstance(body, bytes) else (
+                    body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                )
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self) -> Any:
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                if not raw:
+                    return None
+                if 'application/x-www-form-urlencoded' in (self.headers.get('Content-Type') or ''):
+                    return dict(parse_qsl(raw.decode()))
+                return json.loads(raw)
+
+            def _dispatch(self, method: str):
+                parts = urlsplit(self.path)
+                path = parts.path.rstrip('/') or '/'
+                params = parse_qsl(parts.query, keep_blank_values=True)
+                body = self._body()
+
+                stub = path.startswith('/stub/')
+                key = 'stub ' + path if stub else f'{method} {path}'
+                with backend.lock:
+                    backend.request_counts[key] = backend.request_counts.get(key, 0) + 1
+
+                if not stub and (backend.latency or backend.jitter):
+                    time.sleep(backend.latency + random.uniform(0, backend.jitter))
+
+                if backend.fault_hook:
+                    fault = backend.fault_hook(method, path)
+                    if fault:
+                        status, fault_body = fault
+                        return self._send(status, fault_body)
+
+                if stub:
+                    return self._stub(method, path, body)
+
+                try:
+                    if path.startswith('/auth/v1/token'):
+                        return self._auth()
+                    if path.startswith('/auth/v1/logout'):
+                        return self._send(204, b'')
+                    if path.startswith('/rest/v1/rpc/'):
+                        return self._rpc(path.rsplit('/', 1)[1], body or {})
+                    if path.startswith('/rest/v1/'):
+                        return self._rest(method, path[len('/rest/v1/'):], params, body)
+                    return self._send(404, {'message': 'not found'})
+                except Exception as e:
+                    logger.exception('fake backend error')
+                    return self._send(500, {'message': str(e), 'code': 'XX000', 'hint': None, 'details': None})
+
+            def _auth(self):
+                user = {
+                    'id': backend.user_id, 'aud': 'authenticated', 'role': 'authenticated',
+                    'email': 'worker@example.com', 'app_metadata': {}, 'user_metadata': {},
+                    'created_at': now_iso()
+                }
+                self._send(200, {
+                    'access_token': _fake_jwt(backend.user_id), 'token_type': 'bearer',
+                    'expires_in': 3600, 'expires_at': int(time.time()) + 3600,
+                    'refresh_token': uuid.uuid4().hex, 'user': user
+                })
+
+            def _rpc(self, name: str, params: Dict[str, Any]):
+                handler = getattr(backend, f'rpc_{name}', None)
+                if not handler:
+                    return self._send(404, {'message': f'function {name} does not exist', 'code': 'PGRST202',
+                                            'hint': None, 'details': None})
+                with backend.lock:
+                    result = handler(**params)
+                self._send(200, result)
+
+            def _rest(self, method: str, table: str, params: List[tuple], body: Any):
+                options = dict(params)
+                prefer = self.headers.get('Prefer') or ''
+                single = 'vnd.pgrst.object' in (self.headers.get('Accept') or '')
+
+                with backend.lock:
+                    if method == 'GET':
+                        rows = backend._project(backend._select(table, params), options)
+                    elif method == 'POST':
+                        rows = []
+                        conflict = options.get('on_conflict', 'id')
+                        for row in body if isinstance(body, list) else [body]:
+                            existing = None
+                            if 'merge-duplicates' in prefer:
+                                existing = next((r for r in backend.tables.get(table, [])
+                                                 if row.get(conflict) is not None and r.get(conflict) == row.get(conflict)), None)
+                            if existing:
+                                existing.update(row, updated_at=now_iso())
+                                rows.append(dict(existing))
+                            else:
+                                rows.append(dict(backend.insert(table, row)))
+                    elif method == 'PATCH':
+                        rows = []
+                        for row in backend._select(table, params):
+                            row.update(body or {})
+                            rows.append(dict(row))
+                    elif method == 'DELETE':
+                        targets = backend._select(table, params)
+                        target_ids = {id(row) for row in targets}
+                        backend.tables[table] = [row for row in backend.tables.get(table, []) if id(row) not in target_ids]
+                        rows = [dict(row) for row in targets]
+                    else:
+                        return self._send(405, {'message': 'method not allowed'})
+
+                if single:
+                    if len(rows) != 1:
+                        return self._send(406, {'message': 'JSON object requested, multiple (or no) rows returned',
+                                                'code': 'PGRST116', 'hint': None, 'details': None})
+                    return self._send(200, rows[0])
+                self._send(201 if method == 'POST' else 200, rows)
+
+            def _stub(self, method: str, path: str, body: Any):
+                status, content, headers = render_stub(backend, method, path, body, self.headers.get('Cookie') or '')
+                self._send(status, content, content_type='text/html; charset=utf-8' if isinstance(content, str)
+                           else 'application/json', headers=headers)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PATCH(self):
+                self._dispatch('PATCH')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
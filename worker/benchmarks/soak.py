@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+ワーカーの障害注入ソークテスト
+疑似Supabaseバックエンドに対してlocal-worker/worker.pyを子プロセスで長時間動かし、
+DBタイムアウト・5xx・Chromiumクラッシュ・ページ遷移タイムアウト・処理中のプロセス強制終了を順番に注入して、
+復旧までの時間・取り残されたprocessing行・重複送信・メモリ増加を出力する
+
+使い方:
+    python worker/benchmarks/soak.py --duration 3600 --fault-interval 120
+    python worker/benchmarks/soak.py --duration 28800 --faults db_5xx,chromium_crash --json soak.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any
+
+import psutil
+from cryptography.fernet import Fernet
+
+from bench import REPO_DIR, configure_environment, seed_accounts, seed_tasks, percentile
+from fake_backend import FakeBackend
+from system_metrics import chromium_processes, chromium_tree_rss, MB
+
+logger = logging.getLogger('soak')
+
+FAULT_TYPES = ('db_timeout', 'db_5xx', 'chromium_crash', 'nav_timeout', 'process_kill')
+
+class FaultInjector:
+    """FakeBackendの障害注入フック（期間付きの障害を保持し、リクエストごとに判定）"""
+
+    def __init__(self, backend: FakeBackend, db_timeout_delay: float, nav_timeout_delay: float):
+        self.backend = backend
+        self.db_timeout_delay = db_timeout_delay
+        self.nav_timeout_delay = nav_timeout_delay
+        # 障害種別 -> 終了時刻（monotonic）
+        self.active: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        backend.fault_hook = self.hook
+
+    def activate(self, fault: str, duration: float):
+        with self.lock:
+            self.active[fault] = time.monotonic() + duration
+
+    def is_active(self, fault: str) -> bool:
+        with self.lock:
+            return self.active.get(fault, 0) > time.monotonic()
+
+    def hook(self, method: str, path: str) -> Optional[tuple]:
+        if path.startswith('/stub/'):
+            # ページ本体の応答だけを遅らせる（送信APIは遅らせない）
+            if method == 'GET' and self.is_active('nav_timeout'):
+                time.sleep(self.nav_timeout_delay)
+            return None
+
+        if self.is_active('db_5xx'):
+            return 503, {'message': 'injected fault', 'code': '503', 'hint': None, 'details': None}
+        if self.is_active('db_timeout'):
+            time.sleep(self.db_timeout_delay)
+            return 504, {'message': 'injected timeout', 'code': '504', 'hint': None, 'details': None}
+        return None
+
+class WorkerProcess:
+    """local-worker/worker.pyの子プロセス（強制終了後は同じ設定で再起動）"""
+
+    def __init__(self, log_path: Optional[str]):
+        self.log_path = log_path
+        self.process: Optional[subprocess.Popen] = None
+        self.generation = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self._log = None
+
+    def start(self):
+        if self.log_path:
+            self._log = self._log or open(self.log_path, 'ab')
+        self.process = subprocess.Popen(
+            [sys.executable, str(REPO_DIR / 'local-worker' / 'worker.py')],
+            stdout=self._log or subprocess.DEVNULL, stderr=subprocess.STDOUT if self._log else None
+        )
+        self.generation += 1
+        self.started_at = time.monotonic()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        """SIGKILLで強制終了（cleanupもアウトボックス送信も走らない）"""
+        if self.alive():
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self):
+        self.kill()
+        self.restarts += 1
+        self.start()
+
+    def kill_chromium(self) -> int:
+        """ワーカー配下のChromiumプロセスを強制終了して終了させた数を返す"""
+        if not self.alive():
+            return 0
+        killed = 0
+        for child in chromium_processes(psutil.Process(self.process.pid)):
+            try:
+                child.kill()
+                killed += 1
+            except psutil.Error:
+                continue
+        return killed
+
+    def rss(self) -> Optional[tuple]:
+        """(ワーカーRSS, Chromium RSS)（バイト）"""
+        if not self.alive():
+            return None
+        try:
+            process = psutil.Process(self.process.pid)
+            return process.memory_info().rss, chromium_tree_rss(process)
+        except psutil.Error:
+            return None
+
+    def stop(self, timeout: float = 60):
+        """SIGINTで停止してcleanupを待ち、終わらなければ強制終了"""
+        if not self.alive():
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        if self._log:
+            self._log.close()
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def slope_per_hour(samples: List[tuple]) -> Optional[float]:
+    """(経過秒, MB)の最小二乗の傾き（MB/時）"""
+    if len(samples) < 2:
+        return None
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_v = sum(v for _, v in samples) / n
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return None
+    covariance = sum((t - mean_t) * (v - mean_v) for t, v in samples)
+    return covariance / variance * 3600
+
+class SoakRun:
+    def __init__(self, args, backend: FakeBackend, worker: WorkerProcess, account_ids: List[str]):
+        self.args = args
+        self.backend = backend
+        self.worker = worker
+        self.account_ids = account_ids
+        self.faults = FaultInjector(backend, args.db_timeout_delay, args.nav_timeout_delay)
+
+        self.task_count = 0
+        self.events: List[Dict[str, Any]] = []
+        # 世代（再起動ごと）-> [(経過秒, ワーカーMB, Chromium MB)]
+        self.memory: Dict[int, List[tuple]] = {}
+
+    def top_up(self):
+        """待機中タスクがbacklog件を下回らないように補充"""
+        waiting = sum(1 for row in self.backend.rows('tasks') if row['status'] in ('pending', 'retry'))
+        if waiting < self.args.backlog:
+            added = self.args.backlog - waiting
+            seed_tasks(self.backend, self.account_ids, added, start=self.task_count)
+            self.task_count += added
+
+    def sample_memory(self, elapsed: float):
+        # 起動直後（ブラウザ起動・ログイン）の増加は傾向に含めない
+        if time.monotonic() - self.worker.started_at < self.args.warmup:
+            return
+        rss = self.worker.rss()
+        if rss:
+            self.memory.setdefault(self.worker.generation, []).append((elapsed, rss[0] / MB, rss[1] / MB))
+
+    def wait_for_processing(self, timeout: float = 60) -> bool:
+        """いずれかのタスクが処理中になるまで待つ（処理中に強制終了するため）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(row['status'] == 'processing' for row in self.backend.rows('tasks')):
+                return True
+            time.sleep(0.2)
+        return False
+
+    def inject(self, fault: str):
+        started = utcnow()
+        details: Dict[str, Any] = {}
+        if fault in ('db_timeout', 'db_5xx', 'nav_timeout'):
+            self.faults.activate(fault, self.args.fault_duration)
+            ended = datetime.fromtimestamp(started.timestamp() + self.args.fault_duration, timezone.utc)
+        elif fault == 'chromium_crash':
+            details['killed_processes'] = self.worker.kill_chromium()
+            ended = utcnow()
+        else:
+            details['mid_task'] = self.wait_for_processing()
+            self.worker.restart()
+            ended = utcnow()
+        logger.info(f"障害注入: {fault} {details}")
+        self.events.append({'fault': fault, 'started_at': started, 'ended_at': ended, **details})
+
+    def run(self):
+        faults = [fault for fault in self.args.faults.split(',') if fault]
+        started = time.monotonic()
+        next_fault = started + self.args.warmup
+        next_sample = started
+        fault_index = 0
+
+        self.top_up()
+        self.worker.start()
+        while time.monotonic() - started < self.args.duration:
+            now = time.monotonic()
+            self.top_up()
+
+            # スーパーバイザーと同様に、落ちたワーカーは再起動
+            if not self.worker.alive():
+                logger.warning("ワーカープロセスが終了したため再起動します")
+                self.worker.restart()
+
+            if now >= next_sample:
+                self.sample_memory(now - started)
+                next_sample = now + self.args.sample_interval
+
+            if faults and now >= next_fault:
+                self.inject(faults[fault_index % len(faults)])
+                fault_index += 1
+                next_fault = time.monotonic() + self.args.fault_interval
+
+            time.sleep(1)
+
+    def recovery(self) -> List[Dict[str, Any]]:
+        """障害終了後に最初にタスクが完了するまでの時間（復旧しなければNone）"""
+        completions = sorted(
+            parse_time(row['completed_at']) for row in self.backend.rows('tasks')
+            if row['status'] == 'completed' and row.get('completed_at')
+        )
+        events = []
+        for event in self.events:
+            recovered = next((at for at in completions if at > event['ended_at']), None)
+            events.append({
+                **event,
+                'started_at': event['started_at'].isoformat(),
+                'ended_at': event['ended_at'].isoformat(),
+                'recovery_s': round((recovered - event['ended_at']).total_seconds(), 1) if recovered else None
+            })
+        return events
+
+    def summarize(self, duration: float) -> Dict[str, Any]:
+        tasks = self.backend.rows('tasks')
+        statuses = Counter(row['status'] for row in tasks)
+        now = utcnow()
+
+        # 一定時間以上processingのまま残っている行（どのワーカーも完了させない）
+        orphaned = [
+            row['id'] for row in tasks
+            if row['status'] == 'processing' and row.get('started_at')
+            and (now - parse_time(row['started_at'])).total_seconds() >= self.args.orphan_after
+        ]
+
+        deliveries = Counter((message['recipient'], message['message']) for message in self.backend.sent_messages)
+        duplicates = {f'{recipient}: {message}': count for (recipient, message), count in deliveries.items() if count > 1}
+
+        events = self.recovery()
+        by_fault: Dict[str, Dict[str, Any]] = {}
+        for fault in FAULT_TYPES:
+            times = [event['recovery_s'] for event in events if event['fault'] == fault]
+            if not times:
+                continue
+            recovered = [value for value in times if value is not None]
+            by_fault[fault] = {
+                'injected': len(times),
+                'unrecovered': len(times) - len(recovered),
+                'p50_s': percentile(recovered, 50),
+                'max_s': max(recovered) if recovered else None
+            }
+
+        memory = {}
+        if self.memory:
+            # 再起動でRSSはリセットされるので、最も長く動いた世代で増加傾向を見る
+            longest = max(self.memory.values(), key=len)
+            memory = {
+                'worker_start_mb': round(longest[0][1], 1),
+                'worker_end_mb': round(longest[-1][1], 1),
+                'worker_peak_mb': round(max(sample[1] for samples in self.memory.values() for sample in samples), 1),
+                'chromium_peak_mb': round(max(sample[2] for samples in self.memory.values() for sample in samples), 1),
+                'worker_growth_mb_per_hour': round(slope_per_hour([(t, w) for t, w, _ in longest]) or 0, 2),
+                'chromium_growth_mb_per_hour': round(slope_per_hour([(t, c) for t, _, c in longest]) or 0, 2),
+                'longest_generation_s': round(longest[-1][0] - longest[0][0], 1)
+            }
+
+        return {
+            'duration_s': round(duration, 1),
+            'tasks': len(tasks),
+            'statuses': dict(statuses),
+            'messages_delivered': len(self.backend.sent_messages),
+            'worker_restarts': self.worker.restarts,
+            'orphaned_processing': len(orphaned),
+            'duplicate_deliveries': duplicates,
+            'recovery': by_fault,
+            'faults': events,
+            'memory': memory
+        }
+
+def _seconds(value: Optional[float]) -> str:
+    return f'{value}s' if value is not None else '-'
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nduration: {report['duration_s']}s  tasks: {report['tasks']}  statuses: {report['statuses']}  "
+          f"delivered: {report['messages_delivered']}  restarts: {report['worker_restarts']}")
+    print(f"  orphaned processing rows    {report['orphaned_processing']}")
+    print(f"  duplicate deliveries        {sum(report['duplicate_deliveries'].values())}")
+    print('  time to recovery:')
+    for fault, stats in report['recovery'].items():
+        print(f"    {fault:<16} injected {stats['injected']:<4} unrecovered {stats['unrecovered']:<4} "
+              f"p50 {_seconds(stats['p50_s'])}  max {_seconds(stats['max_s'])}")
+    if report['memory']:
+        memory = report['memory']
+        print(f"  worker RSS                  {memory['worker_start_mb']} → {memory['worker_end_mb']} MB "
+              f"(peak {memory['worker_peak_mb']}, {memory['worker_growth_mb_per_hour']:+} MB/h)")
+        print(f"  chromium RSS                peak {memory['chromium_peak_mb']} MB "
+              f"({memory['chromium_growth_mb_per_hour']:+} MB/h)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='LocalWorkerの障害注入ソークテスト')
+    parser.add_argument('--duration', type=float, default=3600, help='実行秒数')
+    parser.add_argument('--faults', default=','.join(FAULT_TYPES), help=f'順番に注入する障害（{",".join(FAULT_TYPES)}）')
+    parser.add_argument('--fault-interval', type=float, default=120, help='障害注入の間隔（秒）')
+    parser.add_argument('--fault-duration', type=float, default=30, help='DB障害・遷移タイムアウトの継続秒数')
+    parser.add_argument('--db-timeout-delay', type=float, default=30, help='DBタイムアウト注入時の応答遅延（秒）')
+    parser.add_argument('--nav-timeout-delay', type=float, default=35, help='遷移タイムアウト注入時のページ応答遅延（秒）')
+    parser.add_argument('--warmup', type=float, default=60, help='最初の障害注入まで（およびメモリ傾向から除外する起動直後）の秒数')
+    parser.add_argument('--backlog', type=int, default=10, help='常に待機させておくタスク数')
+    parser.add_argument('--accounts', type=int, default=1, help='タスクを割り振るアカウント数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='DBリクエストごとに注入するレイテンシ')
+    parser.add_argument('--max-concurrent', type=int, default=3, help='1回に取得するタスク数（MAX_CONCURRENT）')
+    parser.add_argument('--sample-interval', type=float, default=10, help='メモリのサンプリング間隔（秒）')
+    parser.add_argument('--orphan-after', type=float, default=300, help='processingのまま残った行を孤立とみなす秒数')
+    parser.add_argument('--log', help='ワーカーのログを書き出すパス（省略時は破棄）')
+    parser.add_argument('--json', help='結果をJSONで保存するパス')
+    parser.add_argument('--verbose', action='store_true', help='障害注入のログを表示')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.faults.split(',')) - set(FAULT_TYPES) - {''}
+    if unknown:
+        parser.error(f"未知の障害: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    # 失敗タスクの再試行を試験時間内に何度も回す（明示的に設定されていればそれを使う）
+    os.environ.setdefault('RETRY_BASE_DELAY', '5')
+    os.environ.setdefault('RETRY_MAX_DELAY', '60')
+
+    backend = FakeBackend(latency=args.latency_ms / 1000)
+    backend.start()
+
+    with tempfile.TemporaryDirectory(prefix='worker-soak-') as workdir:
+        cipher = Fernet(configure_environment(backend, workdir, args.max_concurrent))
+        worker = WorkerProcess(args.log)
+        soak = SoakRun(args, backend, worker, seed_accounts(backend, cipher, args.accounts))
+
+        started = time.monotonic()
+        try:
+            soak.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.stop()
+        report = soak.summarize(time.monotonic() - started)
+
+    backend.stop()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    healthy = (
+        not report['orphaned_processing']
+        and not report['duplicate_deliveries']
+        and all(stats['unrecovered'] == 0 for stats in report['recovery'].values())
+    )
+    return 0 if healthy else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+ベンチマーク用のFacebook/Messengerスタブページ
+FacebookAutomationが使うセレクタ（ログインフォーム・メニュー・検索ボックス・入力欄・送信ボタン）だけを
+日本語UIのラベルで再現し（候補の先頭で一致するため待機が発生しない）、
+送信されたメッセージを疑似バックエンドに記録する
+"""
+
+import time
+import uuid
+from http.cookies import SimpleCookie
+from typing import Any, Dict, Tuple, Union
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><title>Log in</title></head>
+<body>
+  <form method="post" action="/stub/facebook/login">
+    <input name="email" type="text">
+    <input name="pass" type="password">
+    <button name="login" type="submit">Log in</button>
+  </form>
+</body></html>
+"""
+
+HOME_PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><title>Facebook</title></head>
+<body>
+  <div role="navigation"><div aria-label="メニュー" role="button">メニュー</div></div>
+</body></html>
+"""
+
+MESSENGER_PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><title>Messenger</title></head>
+<body>
+  <input id="search" type="text" placeholder="Messengerを検索" aria-label="Messengerを検索">
+  <div id="results" role="listbox"></div>
+  <div id="thread" hidden>
+    <div id="composer" aria-label="メッセージ" contenteditable="true" data-text="Aa"></div>
+    <div id="send" aria-label="送信" role="button">送信</div>
+  </div>
+  <script>
+    const search = document.getElementById('search');
+    const results = document.getElementById('results');
+    const thread = document.getElementById('thread');
+    const composer = document.getElementById('composer');
+
+    function openThread(recipient) {
+      thread.dataset.recipient = recipient;
+      thread.hidden = false;
+    }
+
+    // スレッドURLへ直接遷移した場合
+    const match = location.pathname.match(/\/t\/([^/]+)$/);
+    if (match) openThread(decodeURIComponent(match[1]));
+
+    search.addEventListener('input', () => {
+      results.innerHTML = '';
+      if (!search.value) return;
+      const item = document.createElement('div');
+      item.setAttribute('aria-label', search.value);
+      item.textContent = search.value;
+      item.addEventListener('click', () => {
+        // Messengerと同様にスレッドを開くとURLが /t/<id> に変わる
+        history.pushState({}, '', '/stub/messenger/t/' + encodeURIComponent(item.textContent));
+        openThread(item.textContent);
+      });
+      results.appendChild(item);
+    });
+
+    document.getElementById('send').addEventListener('click', () => {
+      fetch('/stub/messenger/send', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({recipient: thread.dataset.recipient, message: composer.innerText})
+      });
+      composer.innerText = '';
+    });
+  </script>
+</body></html>
+"""
+
+def _session_user(cookie_header: str) -> str:
+    cookie = SimpleCookie()
+    cookie.load(cookie_header)
+    return cookie['c_user'].value if 'c_user' in cookie else ''
+
+def render_stub(backend, method: str, path: str, body: Any, cookie_header: str
+                ) -> Tuple[int, Union[str, Dict[str, Any]], Dict[str, str]]:
+    """スタブページの応答（ステータス, 本文, 追加ヘッダー）"""
+    user = _session_user(cookie_header)
+
+    if path == '/stub/facebook/login':
+        if method == 'POST':
+            # ログイン成功扱いでセッションCookieを発行してホームへ
+            user_id = uuid.uuid5(uuid.NAMESPACE_URL, (body or {}).get('email', '')).hex[:15]
+            return 302, '', {
+                'Location': '/stub/facebook',
+                'Set-Cookie': f'c_user={user_id}; Path=/; Max-Age=86400'
+            }
+        return 200, LOGIN_PAGE, {}
+
+    if path == '/stub/facebook':
+        if not user:
+            return 302, '', {'Location': '/stub/facebook/login'}
+        return 200, HOME_PAGE, {}
+
+    if path == '/stub/messenger' or path.startswith('/stub/messenger/t/'):
+        return 200, MESSENGER_PAGE, {}
+
+    if path == '/stub/messenger/send' and method == 'POST':
+        with backend.lock:
+            backend.sent_messages.append({
+                'user': user,
+                'recipient': (body or {}).get('recipient'),
+                'message': (body or {}).get('message'),
+                'sent_at': time.time()
+            })
+        return 200, {'ok': True}, {}
+
+    return 404, 'not found', {}
@@ -0,0 +1,89 @@
+"""
+ブラウザ監視モジュール
+タスクの合間にChromiumの状態を確認し、クラッシュしていれば保存済みセッションから起動し直し、
+コンテキストごとの処理タスク数または前回の作り直しからのRSS増加がしきい値を超えたら
+ページ・コンテキストを作り直す（長時間稼働でのメモリ増加を止める）。
+Chromiumプロセス全体のRSSが上限を超えた場合は、コンテキストではなくブラウザごと起動し直す
+"""
+
+import logging
+import os
+import weakref
+from typing import TYPE_CHECKING, Optional, Callable, Awaitable, Dict, Any
+
+from metrics_server import BROWSER_RECYCLES
+from system_metrics import chromium_tree_rss, MB
+
+# Playwrightは起動を遅らせるため型チェック時のみ読み込む（ブラウザ起動時に初めてimportされる）
+if TYPE_CHECKING:
+    from playwright.async_api import Browser
+    from facebook_automation import FacebookAutomation
+
+logger = logging.getLogger(__name__)
+
+class BrowserWatchdog:
+    def __init__(self):
+        # 設定（0で無効）
+        self.recycle_tasks = int(os.getenv('BROWSER_RECYCLE_TASKS', '50'))
+        self.recycle_rss_mb = float(os.getenv('BROWSER_RECYCLE_RSS_MB', '512'))  # 前回の作り直しからの増加量
+        self.restart_rss_mb = float(os.getenv('BROWSER_RESTART_RSS_MB', '2048'))  # Chromiumプロセス全体
+
+        # FacebookAutomation -> 前回作り直した時点のChromium全体のRSS(MB)
+        self.baselines: "weakref.WeakKeyDictionary[FacebookAutomation, float]" = weakref.WeakKeyDictionary()
+        # 起動し直しても上限を下回らなかった場合、下回るまで起動し直さない（毎タスクの再起動を防ぐ）
+        self._restart_suppressed = False
+
+    def _reason(self, automation: 'FacebookAutomation', can_restart: bool) -> Optional[str]:
+        """作り直す理由（不要ならNone）"""
+        if not automation.is_alive():
+            return 'crash'
+        if self.recycle_tasks and automation.tasks_served >= self.recycle_tasks:
+            return 'tasks'
+
+        # 作り直した直後に同じ理由で繰り返さないよう、1件以上処理したコンテキストのみ対象
+        if not automation.tasks_served or not (self.recycle_rss_mb or self.restart_rss_mb):
+            return None
+        rss = chromium_tree_rss() / MB
+
+        if self.restart_rss_mb:
+            if rss < self.restart_rss_mb:
+                self._restart_suppressed = False
+            elif can_restart and not self._restart_suppressed:
+                return 'restart'
+
+        # 共有ブラウザでは全体のRSSに他のコンテキストの分も含まれるため、このコンテキストを作り直してからの増加で判定
+        baseline = self.baselines.setdefault(automation, rss)
+        if self.recycle_rss_mb and rss - baseline >= self.recycle_rss_mb:
+            return 'rss'
+        return None
+
+    async def check(self, automation: 'FacebookAutomation',
+                    load_session: Callable[[], Optional[Dict[str, Any]]],
+                    get_browser: Optional[Callable[[], Awaitable['Browser']]] = None,
+                    restart_browser: Optional[Callable[[], Awaitable[None]]] = None) -> Optional[str]:
+        """タスク処理前に呼び出し、必要ならブラウザを起動し直すかコンテキストを作り直して理由を返す"""
+        # restart_browserはChromium全体（chromium_tree_rssの対象すべて）を起動し直せる場合のみ渡される
+        reason = self._reason(automation, restart_browser is not None)
+        if not reason:
+            return None
+
+        if reason == 'crash':
+            # クラッシュ後はセッションを取り出せないので最後に保存したものから復元
+            logger.warning(f"ブラウザのクラッシュを検出したため起動し直します: {automation.current_user}")
+            await automation.restart(load_session(), browser=await get_browser() if get_browser else None)
+        elif reason == 'restart':
+            logger.warning(f"Chromium全体のRSSが上限を超えたためブラウザを起動し直します: {automation.current_user}")
+            await restart_browser()
+            # 他のコンテキストも作り直されるので、それぞれの増加量は新しいブラウザから数え直す
+            self.baselines.clear()
+            if chromium_tree_rss() / MB >= self.restart_rss_mb:
+                logger.warning("ブラウザを起動し直してもRSSが上限を下回らないため、下回るまで起動し直しません")
+                self._restart_suppressed = True
+        else:
+            logger.info(f"コンテキストを作り直します（{reason}, 処理タスク数 {automation.tasks_served}）: "
+                        f"{automation.current_user}")
+            await automation.recycle()
+
+        self.baselines[automation] = chromium_tree_rss() / MB
+        BROWSER_RECYCLES.inc(reason=reason)
+        return reason
@@ -0,0 +1,71 @@
+"""
+非同期DBアクセスモジュール
+同期Supabaseクライアントの呼び出しを専用スレッドで実行し、イベントループをブロックしない
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+
+from metrics_server import DB_CALL_DURATION
+from spans import tracer
+
+logger = logging.getLogger(__name__)
+
+def create_supabase_client(supabase_url: str, supabase_key: str) -> Client:
+    """タイムアウト付きのSupabaseクライアントを作成"""
+    timeout = float(os.getenv('DB_TIMEOUT', '10'))
+    return create_client(
+        supabase_url,
+        supabase_key,
+        options=ClientOptions(postgrest_client_timeout=timeout)
+    )
+
+class AsyncDB:
+    def __init__(self, supabase: Client, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.supabase = supabase
+
+        # 設定（デフォルトは1スレッド = keep-alive接続1本を使い回す）
+        self.max_workers = max_workers or int(os.getenv('DB_MAX_WORKERS', '1'))
+        self.timeout = timeout or float(os.getenv('DB_TIMEOUT', '10'))
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='supabase'
+        )
+
+    def table(self, name: str):
+        """クエリビルダー取得（実行はexecute()で行う）"""
+        return self.supabase.table(name)
+
+    async def execute(self, query, timeout: Optional[float] = None):
+        """クエリビルダーの.execute()をスレッドで実行（タスク処理中はDB呼び出しのスパンを記録）"""
+        method = getattr(query, 'http_method', '')
+        step_name = f"db {method} {getattr(query, 'path', '')}".rstrip()
+        started = time.monotonic()
+        try:
+            with tracer.span(step_name):
+                return await self.call(query.execute, timeout=timeout)
+        finally:
+            DB_CALL_DURATION.observe(time.monotonic() - started, method=method)
+
+    async def rpc(self, fn: str, params: Dict[str, Any], timeout: Optional[float] = None):
+        """RPC呼び出し"""
+        return await self.execute(self.supabase.rpc(fn, params), timeout=timeout)
+
+    async def call(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """任意の同期呼び出し（認証など）をスレッドで実行"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+        # スレッド側はクライアントのタイムアウトで打ち切られる
+        return await asyncio.wait_for(future, timeout=timeout or self.timeout)
+
+    def close(self):
+        """スレッドプール停止"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,110 @@
+"""
+実行ログのバッファ書き込みモジュール
+execution_logsへの行をためて一括insertし、タスク処理の待ち時間からログ往復を外す
+"""
+
+import asyncio
+import logging
+import os
+from typing import Optional, List, Dict, Any
+
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+# 再送すれば通る可能性があるエラー（PostgRESTの接続系・DBの接続/リソース不足/停止/競合）
+TRANSIENT_CODE_PREFIXES = ('PGRST00', '08', '53', '57', '40')
+
+def is_permanent_error(e: Exception) -> bool:
+    """再送しても成功しないエラーか（RLS違反・制約違反などサーバーが拒否した4xx）"""
+    if not isinstance(e, APIError):
+        return False
+    code = e.code
+    if isinstance(code, int):
+        return 400 <= code < 500
+    return bool(code) and not str(code).startswith(TRANSIENT_CODE_PREFIXES)
+
+class LogSink:
+    def __init__(self, db, table: str = 'execution_logs'):
+        self.db = db
+        self.table = table
+
+        # 設定
+        self.batch_size = int(os.getenv('LOG_BATCH_SIZE', '50'))
+        self.flush_interval = float(os.getenv('LOG_FLUSH_INTERVAL', '2'))
+        self.max_buffer = int(os.getenv('LOG_MAX_BUFFER', '5000'))
+
+        self.buffer: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        """バックグラウンドフラッシュ開始"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, row: Dict[str, Any]):
+        """ログ行を追加（DBへは書き込まずに即座に戻る）"""
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        """バッチが埋まるかフラッシュ間隔が経過したら書き込み（close()が呼ばれたら実行中の書き込みを終えて抜ける）"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """バッファ内のログを一括insert"""
+        async with self._lock:
+            rows, self.buffer = self.buffer, []
+            if not rows:
+                return
+
+            # PostgRESTの一括insertは全行のキーが揃っている必要がある
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in rows:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+
+            failed: List[Dict[str, Any]] = []
+            pending = list(groups.values())
+            while pending:
+                group = pending[0]
+                try:
+                    await self.db.execute(self.db.table(self.table).insert(group))
+                except asyncio.CancelledError:
+                    # 送信前に取り消された分はバッファに戻す（書き込み中だった分は重複する可能性がある）
+                    self.buffer = ([row for rest in pending for row in rest] + failed + self.buffer)[-self.max_buffer:]
+                    raise
+                except Exception as e:
+                    if is_permanent_error(e):
+                        # 拒否された行は何度送っても通らないため破棄
+                        logger.error(f"ログ一括記録エラー ({len(group)}件を破棄): {str(e)}")
+                    else:
+                        logger.error(f"ログ一括記録エラー ({len(group)}件): {str(e)}")
+                        failed.extend(group)
+                pending.pop(0)
+
+            # 失敗分は次回に再送（上限を超えた古い行は破棄）
+            if failed:
+                self.buffer = (failed + self.buffer)[-self.max_buffer:]
+
+    async def close(self):
+        """停止して残りのログを書き込み"""
+        if self._task:
+            # キャンセルすると単一のDBスレッドで順番待ちの書き込みが取り消されるため、実行中のフラッシュは待つ
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -12,14 +12,27 @@ import logging
 import socket
 import traceback
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, List, Dict, Any
 
 import psutil
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import Client
 from cryptography.fernet import Fernet
 
-from facebook_automation import FacebookAutomation
+from db import AsyncDB, create_supabase_client
+from log_sink import LogSink
+from metrics_server import MetricsServer, LOOP_ITERATION
+from outbox import TaskOutbox
+from spans import tracer
+from system_metrics import SystemMetricsSampler
+from session_store import SessionStore
+from thread_cache import ThreadCache
+from browser_watchdog import BrowserWatchdog
+from account_cache import AccountCache
+from rate_limiter import AccountRateLimiter
+from scheduler import TaskScheduler
+from task_queue import TaskQueue, PermanentTaskError, is_claimable
+from realtime_listener import RealtimeListener
 
 # ログ設定
 logging.basicConfig(
@@ -46,19 +59,63 @@ class LocalWorker:
         if not all([self.supabase_url, self.supabase_key, self.encryption_key]):
             raise ValueError("必要な環境変数が設定されていません")
         
-        # Supabaseクライアント初期化
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        # Supabaseクライアント初期化（DB呼び出しはすべてself.db経由で非同期実行）
+        self.supabase: Client = create_supabase_client(self.supabase_url, self.supabase_key)
+        self.db = AsyncDB(self.supabase)
+        self.log_sink = LogSink(self.db)
+        
+        # ハートビート（メインループとは独立したタスクで送信）
+        self.heartbeat_interval = int(os.getenv('HEARTBEAT_INTERVAL', '30'))
+        self.metrics = SystemMetricsSampler()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self._last_heartbeat_task_id = None
+        
+        # Prometheusメトリクス・ヘルスチェック（METRICS_PORT設定時のみ）
+        self.metrics_server = MetricsServer(self.is_healthy)
         
         # 暗号化
         self.cipher = Fernet(self.encryption_key)
         
-        # Facebook自動化インスタンス
+        # アカウントごとのブラウザセッション（暗号化して保存）
+        self.sessions = SessionStore(self.cipher)
+        
+        # 受信者→スレッドURLのキャッシュ（2回目以降の送信で検索を省く）
+        self.thread_cache = ThreadCache()
+        self.session_account_id = None
+        
+        # アカウント情報・復号済みパスワードのキャッシュ
+        self.accounts = AccountCache(self.db, self.cipher)
+        
+        # アカウント別の日次送信上限（daily_limit）
+        self.rate_limiter = AccountRateLimiter(self.db, self.accounts)
+        
+        # Facebook自動化インスタンス（クラッシュ復旧・長時間稼働時のコンテキスト作り直しはwatchdog）
         self.facebook = None
+        self.watchdog = BrowserWatchdog()
+        
+        # ブラウザ起動タイミング（eager: 起動時に待つ / background: 登録後に裏で起動 / lazy: 最初のタスクで起動）
+        self.browser_launch = os.getenv('BROWSER_LAUNCH', 'background').lower()
+        self.browser_task: Optional[asyncio.Task] = None
         
         # ワーカー状態
         self.is_running = False
         self.current_task = None
         self.worker_id = None
+        self.task_queue = TaskQueue(self.db)
+        
+        # 状態遷移はローカルのアウトボックスに記録してからバックグラウンドで送信
+        self.outbox = TaskOutbox(self.task_queue)
+        
+        # Realtimeによるタスク通知（未接続時は短い間隔のポーリングに戻る）
+        self.realtime_enabled = os.getenv('REALTIME_ENABLED', 'true').lower() == 'true'
+        self.fallback_poll_interval = int(os.getenv('FALLBACK_POLL_INTERVAL', '60'))
+        self.realtime: Optional[RealtimeListener] = None
+        self.realtime_task: Optional[asyncio.Task] = None
+        self.task_event = asyncio.Event()
+        self.claim_requested = False
+        
+        # scheduled_at付きタスクの予約スケジューラー
+        self.scheduler = TaskScheduler(self.db)
         
         logger.info(f"ワーカー初期化完了: {self.worker_name}")
 
@@ -66,13 +123,22 @@ class LocalWorker:
         """ワーカー開始"""
         try:
             logger.info("ワーカーを開始しています...")
+            await self.metrics_server.start()
             
             # ワーカー登録
             await self.register_worker()
+            self.log_sink.start()
+            self.outbox.start()
             
-            # Facebook自動化初期化
-            self.facebook = FacebookAutomation()
-            await self.facebook.initialize()
+            # タスク処理中（ブラウザ操作・2FA待ち）もハートビートを送り続ける
+            self.metrics.start()
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+            
+            # Facebook自動化初期化（ブラウザ起動を待たずにタスク待機に入れるよう既定はバックグラウンド）
+            if self.browser_launch == 'eager':
+                await self.ensure_browser()
+            elif self.browser_launch == 'background':
+                self.browser_task = asyncio.create_task(self.launch_browser())
             
             self.is_running = True
             logger.info("ワーカーが正常に開始されました")
@@ -85,6 +151,31 @@ class LocalWorker:
             logger.error(traceback.format_exc())
             await self.cleanup()
 
+    async def launch_browser(self):
+        """Playwrightを読み込んでブラウザを起動"""
+        from facebook_automation import FacebookAutomation
+        
+        started = asyncio.get_running_loop().time()
+        facebook = FacebookAutomation(self.thread_cache)
+        try:
+            await facebook.initialize()
+        except BaseException:
+            # 起動途中で失敗・キャンセルされてもPlaywrightドライバとブラウザを残さない
+            await facebook.cleanup()
+            raise
+        self.facebook = facebook
+        logger.info(f"ブラウザ起動完了（{asyncio.get_running_loop().time() - started:.1f}秒）")
+    
+    async def ensure_browser(self):
+        """ブラウザが起動済みであることを保証（起動中なら完了を待ち、失敗していれば起動し直す）"""
+        if self.facebook:
+            return
+        if not self.browser_task or (self.browser_task.done() and
+                                     (self.browser_task.cancelled() or self.browser_task.exception())):
+            self.browser_task = asyncio.create_task(self.launch_browser())
+        # タスク側のキャンセルで起動処理自体が中断されないようにする
+        await asyncio.shield(self.browser_task)
+    
     async def register_worker(self):
         """ワーカーをデータベースに登録"""
         try:
@@ -98,7 +189,7 @@ class LocalWorker:
             }
             
             # ワーカー登録
-            result = self.supabase.table('worker_connections').upsert({
+            result = await self.db.execute(self.db.table('worker_connections').upsert({
                 'worker_name': self.worker_name,
                 'worker_type': self.worker_type,
                 'status': 'online',
@@ -106,10 +197,12 @@ class LocalWorker:
                 'hostname': system_info['hostname'],
                 'system_info': system_info,
                 'last_heartbeat': datetime.utcnow().isoformat()
-            }).execute()
+            }))
             
             if result.data:
                 self.worker_id = result.data[0]['id']
+                self.task_queue.worker_id = self.worker_id
+                tracer.bind(self.log_sink, self.worker_id)
                 logger.info(f"ワーカー登録完了: ID {self.worker_id}")
             else:
                 raise Exception("ワーカー登録に失敗しました")
@@ -120,28 +213,60 @@ class LocalWorker:
 
     async def main_loop(self):
         """メインループ"""
-        heartbeat_interval = 30  # 30秒間隔
-        task_check_interval = 5   # 5秒間隔
+        task_check_interval = 5   # Realtime未接続時は5秒間隔
+        
+        # Realtime購読開始
+        if self.realtime_enabled:
+            self.realtime = RealtimeListener(
+                self.supabase_url, self.supabase_key, ['tasks', 'facebook_accounts'], self.on_realtime_change,
+                on_disconnect=self.task_event.set
+            )
+            self.realtime_task = asyncio.create_task(self.realtime.run())
         
-        last_heartbeat = datetime.utcnow()
-        last_task_check = datetime.utcnow()
+        loop = asyncio.get_running_loop()
+        last_task_check = 0.0
         
         while self.is_running:
             try:
-                current_time = datetime.utcnow()
+                current_time = loop.time()
+                
+                # Realtime接続中はフォールバック用の低頻度ポーリングのみ
+                if self.realtime and self.realtime.connected:
+                    poll_interval = self.fallback_poll_interval
+                else:
+                    poll_interval = task_check_interval
                 
-                # ハートビート送信
-                if (current_time - last_heartbeat).seconds >= heartbeat_interval:
-                    await self.send_heartbeat()
-                    last_heartbeat = current_time
+                # 先読み期間内の予約タスクを同期
+                if self.scheduler.needs_sync():
+                    await self.scheduler.sync()
                 
-                # タスクチェック
-                if (current_time - last_task_check).seconds >= task_check_interval:
-                    await self.check_and_process_tasks()
+                # 予約時刻に達したタスクがあれば取得
+                if self.scheduler.pop_due():
+                    self.claim_requested = True
+                
+                # タスクチェック（通知受信時・予約時刻到達時またはポーリング間隔経過時）
+                self.task_event.clear()
+                if self.claim_requested or current_time - last_task_check >= poll_interval:
+                    self.claim_requested = False
                     last_task_check = current_time
+                    if await self.check_and_process_tasks():
+                        # 残りのタスクがないか続けて確認
+                        self.claim_requested = True
+                        LOOP_ITERATION.observe(loop.time() - current_time)
+                        continue
+                
+                LOOP_ITERATION.observe(loop.time() - current_time)
                 
-                # 短時間待機
-                await asyncio.sleep(1)
+                # 通知・次の予約時刻・ポーリング間隔のいずれかまで待機
+                timeout = max(0, min(
+                    last_task_check + poll_interval - loop.time(),
+                    self.scheduler.seconds_until_next(),
+                    self.scheduler.seconds_until_sync()
+                ))
+                try:
+                    await asyncio.wait_for(self.task_event.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
                 
             except KeyboardInterrupt:
                 logger.info("停止シグナルを受信しました")
@@ -151,54 +276,98 @@ class LocalWorker:
                 logger.error(traceback.format_exc())
                 await asyncio.sleep(5)  # エラー時は少し長めに待機
 
+    def warm_accounts(self) -> List[str]:
+        """ブラウザのセッションを保持しているアカウント（切り替えなしで処理できる）"""
+        return [self.session_account_id] if self.session_account_id else []
+
+    def is_healthy(self) -> bool:
+        """ヘルスチェック（メインループ稼働中かつハートビートタスクが生きているか）"""
+        return self.is_running and self.heartbeat_task is not None and not self.heartbeat_task.done()
+
+    def on_realtime_change(self, table: str, change_type: str, record: Dict[str, Any], old_record: Dict[str, Any]):
+        """Realtime変更通知（取得可能なタスクの増加・予約の変更でメインループを起こす）"""
+        if table == 'tasks' and change_type in ('INSERT', 'UPDATE') and is_claimable(record):
+            self.claim_requested = True
+            # 他ワーカーのセッション待ちで取得できなかった場合に備え、猶予が切れる時刻にも取得し直す
+            self.scheduler.add_affinity_wake(record)
+            self.task_event.set()
+        if self.scheduler.on_change(table, change_type, record, old_record):
+            self.task_event.set()
+        self.accounts.on_change(table, change_type, record, old_record)
+
+    async def heartbeat_loop(self):
+        """ハートビート送信ループ"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.send_heartbeat()
+
     async def send_heartbeat(self):
-        """ハートビート送信"""
+        """ハートビート送信（last_heartbeatとリース延長は毎回、その他は変化した項目のみ送る）"""
         try:
-            system_stats = {
-                'cpu_percent': psutil.cpu_percent(),
-                'memory_percent': psutil.virtual_memory().percent,
-                'disk_percent': psutil.disk_usage('/').percent if os.path.exists('/') else 0
-            }
+            # last_heartbeatの更新・処理中タスクのリース延長・セッション保持中アカウントの公開を1往復で
+            await self.task_queue.extend_leases(warm_accounts=self.warm_accounts())
+            
+            update = {}
+            
+            # システム統計はサンプラーの移動平均が大きく変化したときだけ送信
+            system_stats = self.metrics.changed_stats()
+            if system_stats:
+                update['system_stats'] = system_stats
+            
+            current_task_id = self.current_task.get('id') if self.current_task else None
+            if current_task_id != self._last_heartbeat_task_id:
+                update['current_task_id'] = current_task_id
+            
+            if update:
+                await self.db.execute(self.db.table('worker_connections').update(update).eq('id', self.worker_id))
+            self._last_heartbeat_task_id = current_task_id
             
-            self.supabase.table('worker_connections').update({
-                'last_heartbeat': datetime.utcnow().isoformat(),
-                'system_stats': system_stats,
-                'current_task_id': self.current_task.get('id') if self.current_task else None
-            }).eq('id', self.worker_id).execute()
+            # 障害明けは送信済みタスクの結果を先に反映してから、停止したワーカーが残したリース切れタスクを再キュー
+            await self.outbox.resume()
+            await self.task_queue.reap_expired()
             
             logger.debug("ハートビート送信完了")
             
         except Exception as e:
             logger.error(f"ハートビート送信エラー: {str(e)}")
 
-    async def check_and_process_tasks(self):
-        """タスクチェックと処理"""
+    async def check_and_process_tasks(self) -> bool:
+        """タスクチェックと処理（タスクを処理した場合はTrue）"""
         try:
             # 現在処理中のタスクがある場合はスキップ
             if self.current_task:
-                return
-            
-            # 待機中のタスクを取得
-            result = self.supabase.table('tasks').select('*').eq('status', 'pending').order('created_at').limit(1).execute()
+                return False
+            
+            # 長く待たされている低優先度タスクを昇格（一定間隔ごと）
+            await self.task_queue.age_priorities()
+            
+            # 待機中のタスクを優先度→作成日時順に原子的に取得（processingへの更新も同時に行われる）
+            # 当日の送信上限に達したアカウントのタスクは取得しない。
+            # 現在のセッションのアカウントを優先し、他ワーカーがセッションを持つアカウントは猶予後のみ取得
+            tasks = await self.task_queue.claim(
+                1,
+                exclude_accounts=self.rate_limiter.exhausted_accounts(),
+                warm_accounts=self.warm_accounts()
+            )
             
-            if not result.data:
-                return
+            if not tasks:
+                return False
             
-            task = result.data[0]
+            task = tasks[0]
             logger.info(f"新しいタスクを検出: {task['id']}")
             
-            # タスクを処理中に更新
-            self.supabase.table('tasks').update({
-                'status': 'processing',
-                'started_at': datetime.utcnow().isoformat(),
-                'worker_id': self.worker_id
-            }).eq('id', task['id']).execute()
+            # 送信上限を超える場合は失敗にせず延期
+            if not await self.rate_limiter.reserve(task, self.outbox):
+                return True
             
-            # タスク処理
-            await self.process_task(task)
+            # タスク処理（ステップごとの所要時間をスパンとして記録）
+            with tracer.task(task['id']), tracer.span('process_task'):
+                await self.process_task(task)
+            return True
             
         except Exception as e:
             logger.error(f"タスクチェックエラー: {str(e)}")
+            return False
 
     async def process_task(self, task: Dict[Any, Any]):
         """タスク処理"""
@@ -206,41 +375,44 @@ class LocalWorker:
         task_id = task['id']
         
         try:
-            logger.info(f"タスク処理開始: {task_id}")
-            
-            # タスクタイプに応じて処理
-            if task['task_type'] == 'send_message':
-                await self.process_send_message_task(task)
-            else:
-                raise ValueError(f"未対応のタスクタイプ: {task['task_type']}")
-            
-            # タスク完了
-            self.supabase.table('tasks').update({
-                'status': 'completed',
-                'completed_at': datetime.utcnow().isoformat(),
-                'result': {'success': True}
-            }).eq('id', task_id).execute()
-            
-            # 実行ログ記録
-            await self.log_task_execution(task_id, 'completed', None)
-            
-            logger.info(f"タスク完了: {task_id}")
+            try:
+                logger.info(f"タスク処理開始: {task_id}")
+                
+                # タスクタイプに応じて処理
+                if task['task_type'] == 'send_message':
+                    await self.process_send_message_task(task)
+                else:
+                    raise PermanentTaskError(f"未対応のタスクタイプ: {task['task_type']}")
+                
+                status, error_message, retry_at = 'completed', None, None
+                result = {'success': True}
+                logger.info(f"タスク完了: {task_id}")
+                
+            except Exception as e:
+                error_message = str(e)
+                logger.error(f"タスク処理エラー {task_id}: {error_message}")
+                logger.error(traceback.format_exc())
+                
+                status = 'failed'
+                result = {'success': False, 'error': error_message}
+                
+                # 再試行はバックオフ後の予約時刻まで延期（max_retries到達時のdead_letterはcomplete_task側）
+                retry_at = None if isinstance(e, PermanentTaskError) else self.task_queue.retry_at(task.get('retry_count') or 0)
+                
+                # 送信していないので送信枠を返却
+                self.rate_limiter.release_task(task)
+            
+            # ステータス更新・実行ログ・日次統計はアウトボックス経由で記録（DB障害中も失わない）
+            self.outbox.record(
+                task_id, status,
+                result=result,
+                error_message=error_message,
+                details={'worker': self.worker_name, 'error': error_message},
+                scheduled_at=retry_at
+            )
             
         except Exception as e:
-            error_message = str(e)
-            logger.error(f"タスク処理エラー {task_id}: {error_message}")
-            logger.error(traceback.format_exc())
-            
-            # タスク失敗
-            self.supabase.table('tasks').update({
-                'status': 'failed',
-                'completed_at': datetime.utcnow().isoformat(),
-                'error_message': error_message,
-                'result': {'success': False, 'error': error_message}
-            }).eq('id', task_id).execute()
-            
-            # 実行ログ記録
-            await self.log_task_execution(task_id, 'failed', error_message)
+            logger.error(f"タスク完了記録エラー {task_id}: {str(e)}")
             
         finally:
             self.current_task = None
@@ -248,17 +420,27 @@ class LocalWorker:
     async def process_send_message_task(self, task: Dict[Any, Any]):
         """メッセージ送信タスク処理"""
         try:
-            # アカウント情報取得
-            account_result = self.supabase.table('facebook_accounts').select('*').eq('id', task['account_id']).single().execute()
-            account = account_result.data
+            # アカウント情報取得（キャッシュ済みなら復号済みパスワードをそのまま使う）
+            account = await self.accounts.get(task['account_id'])
+            
+            # 先行起動が終わっていなければ待つ（lazy時はここで初めて起動）
+            await self.ensure_browser()
+            
+            # タスクの合間にクラッシュ復旧・コンテキストの作り直し（セッションは引き継ぐ）
+            await self.watchdog.check(
+                self.facebook,
+                lambda: self.sessions.load(self.session_account_id) if self.session_account_id else None,
+                restart_browser=self.facebook.relaunch
+            )
             
-            # パスワード復号化
-            encrypted_password = account['encrypted_password'].encode()
-            password = self.cipher.decrypt(encrypted_password).decode()
+            # アカウントが変わったら保存済みセッションに切り替え
+            if self.session_account_id != account['id']:
+                await self.switch_session(account)
             
             # Facebookにログイン
             if not await self.facebook.is_logged_in():
-                await self.facebook.login(account['email'], password)
+                await self.facebook.login(account['email'], account['password'])
+                self.sessions.save(account['id'], await self.facebook.export_session())
             
             # メッセージ送信
             await self.facebook.send_message(
@@ -272,34 +454,61 @@ class LocalWorker:
             logger.error(f"メッセージ送信エラー: {str(e)}")
             raise
 
-    async def log_task_execution(self, task_id: str, status: str, error_message: Optional[str] = None):
-        """タスク実行ログ記録"""
+    async def switch_session(self, account: Dict[Any, Any]):
+        """現在のセッションを保存し、別アカウントのセッションを復元"""
+        await self.save_session()
+        
+        await self.facebook.open_context(self.sessions.load(account['id']), account['email'])
+        self.session_account_id = account['id']
+        
+        logger.info(f"セッション切り替え: {account['email']}")
+
+    async def save_session(self):
+        """現在のアカウントのセッションを保存"""
+        if not self.session_account_id or not self.facebook or not self.facebook.logged_in:
+            return
         try:
-            self.supabase.table('execution_logs').insert({
-                'task_id': task_id,
-                'worker_id': self.worker_id,
-                'status': status,
-                'error_message': error_message,
-                'executed_at': datetime.utcnow().isoformat()
-            }).execute()
+            self.sessions.save(self.session_account_id, await self.facebook.export_session())
         except Exception as e:
-            logger.error(f"ログ記録エラー: {str(e)}")
+            logger.error(f"セッション保存エラー: {str(e)}")
 
     async def cleanup(self):
         """クリーンアップ"""
         try:
             self.is_running = False
             
+            # ハートビート・メトリクス停止
+            if self.heartbeat_task:
+                self.heartbeat_task.cancel()
+            self.metrics.stop()
+            await self.metrics_server.stop()
+            
+            # Realtime購読停止
+            if self.realtime:
+                self.realtime.stop()
+            if self.realtime_task:
+                self.realtime_task.cancel()
+            
+            # 未送信の実行ログ・状態遷移を書き込み
+            await self.log_sink.close()
+            await self.outbox.close()
+            
             # ワーカーステータス更新
             if self.worker_id:
-                self.supabase.table('worker_connections').update({
+                await self.db.execute(self.db.table('worker_connections').update({
                     'status': 'offline',
                     'last_heartbeat': datetime.utcnow().isoformat()
-                }).eq('id', self.worker_id).execute()
+                }).eq('id', self.worker_id))
             
-            # Facebook自動化クリーンアップ
+            # Facebook自動化クリーンアップ（次回起動時のためにセッションを保存）
+            if self.browser_task and not self.browser_task.done():
+                self.browser_task.cancel()
             if self.facebook:
+                await self.save_session()
                 await self.facebook.cleanup()
+            self.thread_cache.close()
+            
+            self.db.close()
             
             logger.info("クリーンアップ完了")
             
@@ -0,0 +1,188 @@
+"""
+メトリクス・ヘルスチェックHTTPモジュール
+プロセス内のカウンター・ゲージ・ヒストグラムをPrometheusテキスト形式で /metrics に公開し、
+Render・Railwayのヘルスチェック用に /healthz を返す（スクレイプ時にDBへはアクセスしない）
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+from typing import Optional, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 秒単位のヒストグラム境界（ステップ・DB呼び出し・キュー待ち時間で共通）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # ラベル -> (バケット別件数, 合計, 件数)
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            labels = _format_labels(self.label_names, key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+REGISTRY = Registry()
+
+# ワーカー共通のメトリクス（各モジュールから直接更新する）
+STEP_DURATION = REGISTRY.register(Histogram(
+    'worker_step_duration_seconds', 'Duration of task processing steps', ('step',)))
+QUEUE_LAG = REGISTRY.register(Histogram(
+    'worker_queue_lag_seconds', 'Time between task creation and claim'))
+DB_CALL_DURATION = REGISTRY.register(Histogram(
+    'worker_db_call_duration_seconds', 'Duration of Supabase calls', ('method',)))
+LOOP_ITERATION = REGISTRY.register(Histogram(
+    'worker_loop_iteration_seconds', 'Duration of one main loop iteration'))
+TASKS_TOTAL = REGISTRY.register(Counter(
+    'worker_tasks_total', 'Tasks finished by this worker', ('status',)))
+TASK_RETRIES = REGISTRY.register(Counter(
+    'worker_task_retries_total', 'Claimed tasks that had already failed before'))
+BROWSER_RSS = REGISTRY.register(Gauge(
+    'worker_browser_rss_bytes', 'Resident memory of Chromium processes'))
+PROCESS_RSS = REGISTRY.register(Gauge(
+    'worker_process_rss_bytes', 'Resident memory of the worker process'))
+OUTBOX_PENDING = REGISTRY.register(Gauge(
+    'worker_outbox_pending', 'Task transitions waiting to be pushed'))
+BROWSER_RECYCLES = REGISTRY.register(Counter(
+    'worker_browser_recycles_total', 'Browser contexts recycled or restarted by the watchdog', ('reason',)))
+SELECTOR_LOOKUPS = REGISTRY.register(Counter(
+    'worker_selector_lookups_total', 'Selector resolutions by remembered-winner outcome', ('group', 'result')))
+
+class MetricsServer:
+    def __init__(self, health_check: Optional[Callable[[], bool]] = None, port: Optional[int] = None):
+        self.health_check = health_check
+        self.port = port if port is not None else int(os.getenv('METRICS_PORT', '0') or 0)
+        self.host = os.getenv('METRICS_HOST', '0.0.0.0')
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """HTTPサーバー起動（METRICS_PORT未設定時は起動しない）"""
+        if not self.port or self.server:
+            return
+        try:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.info(f"メトリクスエンドポイント起動: http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            logger.error(f"メトリクスエンドポイント起動エラー: {str(e)}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # ヘッダーは読み捨て
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) >= 2 else ''
+
+            if path == '/metrics':
+                status, body = '200 OK', REGISTRY.render()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/healthz':
+                healthy = self.health_check() if self.health_check else True
+                status, body = ('200 OK', 'ok\n') if healthy else ('503 Service Unavailable', 'unhealthy\n')
+                content_type = 'text/plain; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', 'not found\n', 'text/plain; charset=utf-8'
+
+            payload = body.encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"メトリクスリクエストエラー: {str(e)}")
+        finally:
+            writer.close()
+
+    async def stop(self):
+        """HTTPサーバー停止"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,159 @@
+"""
+タスク状態遷移アウトボックスモジュール
+完了・失敗・延期をまずローカルのSQLite（WALモード）に追記し、
+バックグラウンドで記録順にバッチ送信する（Supabase障害中も結果を失わない）
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional, List, Dict, Any
+
+from metrics_server import TASKS_TOTAL, OUTBOX_PENDING
+
+logger = logging.getLogger(__name__)
+
+class TaskOutbox:
+    def __init__(self, task_queue, path: Optional[str] = None):
+        self.task_queue = task_queue
+        self.path = path or os.getenv('OUTBOX_PATH', 'outbox.db')
+
+        # 設定
+        self.batch_size = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+        self.replay_interval = float(os.getenv('OUTBOX_REPLAY_INTERVAL', '5'))
+        # 送信を待つ間にリースが切れると他のワーカーが送信済みのタスクを再キューするため、リース期間の半分までに抑える
+        self.max_backoff = min(300, task_queue.lease_seconds / 2)
+
+        # WALモードではsynchronous=NORMALでもプロセスが落ちただけならコミット済みの行は残る
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS transitions (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                worker_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+        self._failures = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """バックグラウンド送信開始（前回終了時の未送信分もここで再送される）"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+            pending = self.pending()
+            OUTBOX_PENDING.set(pending)
+            if pending:
+                self._wakeup.set()
+
+    def record(self, task_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error_message: Optional[str] = None, details: Optional[Dict[str, Any]] = None,
+               scheduled_at: Optional[str] = None) -> int:
+        """状態遷移をローカルに追記して即座に戻る（DBへの送信はバックグラウンド）"""
+        if not self.task_queue.worker_id:
+            raise ValueError("worker_idが未設定のため状態遷移を記録できません")
+
+        payload = {
+            'result': result,
+            'error_message': error_message,
+            'details': details,
+            'scheduled_at': scheduled_at
+        }
+        cursor = self.conn.execute(
+            'INSERT INTO transitions (task_id, worker_id, status, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+            (task_id, self.task_queue.worker_id, status, json.dumps(payload), time.time())
+        )
+        self.conn.commit()
+
+        TASKS_TOTAL.inc(status=status)
+        OUTBOX_PENDING.inc()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def pending(self) -> int:
+        """未送信の状態遷移数"""
+        return self.conn.execute('SELECT COUNT(*) FROM transitions').fetchone()[0]
+
+    async def _run(self):
+        """記録があるか再送間隔が経過したら送信（失敗が続く間は間隔を延ばす）"""
+        while True:
+            timeout = min(self.replay_interval * (2 ** self._failures), self.max_backoff)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """未送信分を記録順にバッチ送信（すべて送れたらTrue、通信エラー時は残して次回再送）"""
+        async with self._lock:
+            while True:
+                rows = self.conn.execute(
+                    'SELECT seq, task_id, worker_id, status, payload FROM transitions ORDER BY seq LIMIT ?',
+                    (self.batch_size,)
+                ).fetchall()
+                if not rows:
+                    self._failures = 0
+                    OUTBOX_PENDING.set(0)
+                    return True
+
+                items = [
+                    {**json.loads(payload), 'seq': seq, 'task_id': task_id, 'worker_id': worker_id, 'status': status}
+                    for seq, task_id, worker_id, status, payload in rows
+                ]
+                try:
+                    results = await self.task_queue.apply_transitions(items)
+                except Exception as e:
+                    self._failures = min(self._failures + 1, 10)
+                    pending = self.pending()
+                    OUTBOX_PENDING.set(pending)
+                    logger.warning(f"状態遷移の送信エラー（{pending}件を保持）: {str(e)}")
+                    return False
+
+                # 個別のエラーは再送しても直らないので記録して破棄
+                for item in results:
+                    if item.get('error'):
+                        logger.error(f"状態遷移の適用エラー seq={item.get('seq')}: {item['error']}")
+
+                self.conn.execute('DELETE FROM transitions WHERE seq <= ?', (rows[-1][0],))
+                self.conn.commit()
+                self._failures = 0
+                logger.debug(f"状態遷移を送信: {len(rows)}件")
+
+    async def resume(self) -> bool:
+        """DBへの疎通が戻ったとき（ハートビート成功時）に再送待ちを打ち切って送信"""
+        if not self._failures:
+            return True
+        self._failures = 0
+        logger.info("DBへの疎通が戻ったため状態遷移を再送します")
+        return await self.flush()
+
+    async def close(self):
+        """停止して残りを送信（送れなかった分はディスクに残り次回起動時に再送）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        finally:
+            remaining = self.pending()
+            if remaining:
+                logger.warning(f"未送信の状態遷移 {remaining}件を次回起動時に再送します")
+            self.conn.close()
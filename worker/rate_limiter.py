@@ -0,0 +1,145 @@
+"""
+アカウント別送信制限モジュール
+facebook_accounts.daily_limitをメモリ上のトークンバケットで管理（日付が変わると満タンに戻る）
+上限のあるアカウントは全ワーカー合計で超えないようDB側でも送信枠を確保する（reserve_send_quota）
+"""
+
+import logging
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional, Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, day: date, limit: Optional[int], used: int = 0):
+        self.day = day
+        self.limit = limit
+        self.used = used
+
+    @property
+    def remaining(self) -> float:
+        if self.limit is None:
+            return float('inf')
+        return max(self.limit - self.used, 0)
+
+class AccountRateLimiter:
+    def __init__(self, db, accounts):
+        self.db = db
+        self.accounts = accounts
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def today() -> date:
+        """日次統計と同じUTC基準の日付"""
+        return datetime.now(timezone.utc).date()
+
+    @staticmethod
+    def next_reset() -> datetime:
+        """次にトークンが満タンに戻る時刻（翌日0時UTC）"""
+        tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+        return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc)
+
+    async def seed(self, account_id: str, daily_limit: Optional[int]):
+        """当日分のバケットを用意（当日初回のみdaily_statisticsから送信済み件数を取得）"""
+        today = self.today()
+        bucket = self._buckets.get(account_id)
+        if bucket and bucket.day == today:
+            bucket.limit = daily_limit
+            return
+
+        used = 0
+        if daily_limit is not None:
+            result = await self.db.execute(
+                self.db.table('daily_statistics').select('sent_count')
+                .eq('account_id', account_id).eq('date', today.isoformat()).limit(1)
+            )
+            if result.data:
+                used = result.data[0].get('sent_count') or 0
+
+        self._buckets[account_id] = TokenBucket(today, daily_limit, used)
+        logger.debug(f"送信制限初期化 {account_id}: {used}/{daily_limit}")
+
+    def try_acquire(self, account_id: str) -> bool:
+        """1件分のトークンを取得（上限に達していればFalse）"""
+        bucket = self._buckets.get(account_id)
+        if not bucket:
+            return True
+
+        if bucket.day != self.today():
+            bucket.day, bucket.used = self.today(), 0
+
+        if bucket.remaining < 1:
+            return False
+        bucket.used += 1
+        return True
+
+    def release(self, account_id: str):
+        """送信しなかったタスクのトークンを返却"""
+        bucket = self._buckets.get(account_id)
+        if bucket and bucket.day == self.today() and bucket.used > 0:
+            bucket.used -= 1
+
+    async def reserve(self, task: Dict[str, Any], outbox) -> bool:
+        """取得したタスクの送信枠を確保（上限到達時はタスクを翌日0時UTCまで延期してFalse）"""
+        if task['task_type'] != 'send_message':
+            return True
+
+        try:
+            account = await self.accounts.get(task['account_id'])
+            await self.seed(account['id'], account.get('daily_limit'))
+        except Exception as e:
+            # アカウント取得エラーはタスク処理側で失敗として記録される（枠は確保しない）
+            logger.error(f"送信制限確認エラー: {str(e)}")
+            return True
+
+        # ローカルのバケットで上限到達が分かっている分はDBに問い合わせない
+        if not self.try_acquire(account['id']):
+            return self._defer(task, outbox, self.next_reset().isoformat())
+
+        if account.get('daily_limit') is not None:
+            # 他ワーカーの送信分も含めてDB側で原子的に確保（reserve_send_quota）
+            try:
+                reserved = await outbox.task_queue.reserve_quota(task['id'])
+            except Exception as e:
+                # 確保できたか分からないまま送信しない（少し待って再取得）
+                logger.error(f"送信枠確保エラー {task['id']}: {str(e)}")
+                self.release(account['id'])
+                return self._defer(task, outbox, outbox.task_queue.retry_at(0))
+
+            if reserved is None:
+                # リースを失ったタスク（他のワーカーに回収済み）
+                logger.warning(f"リース中でないため送信枠を確保しません: {task['id']}")
+                self.release(account['id'])
+                return False
+
+            if not reserved:
+                # 他ワーカーの送信で上限に到達済み（当日中はこのワーカーでも取得しない）
+                bucket = self._buckets[account['id']]
+                bucket.used = max(bucket.used, bucket.limit)
+                return self._defer(task, outbox, self.next_reset().isoformat())
+
+        # 返却は確保したタスクのみ（release_task）
+        task['quota_reserved'] = True
+        return True
+
+    def _defer(self, task: Dict[str, Any], outbox, until: str) -> bool:
+        """送信枠を確保できなかったタスクをuntilまで延期（常にFalse）"""
+        try:
+            outbox.record(task['id'], 'deferred', scheduled_at=until)
+            logger.info(f"送信枠を確保できないためタスクを延期: {task['id']} → {until}")
+        except Exception as e:
+            logger.error(f"タスク延期エラー {task['id']}: {str(e)}")
+        return False
+
+    def release_task(self, task: Dict[str, Any]):
+        """送信しなかったタスクのローカルの送信枠を返却（DB側はタスクが処理中でなくなれば自動で返る）"""
+        if task.pop('quota_reserved', False):
+            self.release(task['account_id'])
+
+    def exhausted_accounts(self) -> List[str]:
+        """当日の上限に達したアカウント（claim_tasksの除外対象）"""
+        today = self.today()
+        return [
+            account_id for account_id, bucket in self._buckets.items()
+            if bucket.day == today and bucket.remaining < 1
+        ]
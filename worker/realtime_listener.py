@@ -0,0 +1,188 @@
+"""
+Supabase Realtime購読モジュール
+supabase_realtime publication（step6_indexes.sql）の変更通知をasyncioで受信
+"""
+
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Iterable, Optional, Dict, Any, Set
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# on_change(table, change_type, record, old_record)
+ChangeCallback = Callable[[str, str, Dict[str, Any], Dict[str, Any]], None]
+# 最新のアクセストークンを返す（期限切れ前に更新されたものを使う）
+TokenProvider = Callable[[], Awaitable[Optional[str]]]
+
+class ChannelError(Exception):
+    """チャンネルへの参加拒否・切断（再接続して参加し直す）"""
+
+class RealtimeListener:
+    def __init__(self, supabase_url: str, supabase_key: str, tables: Iterable[str],
+                 on_change: ChangeCallback, token_provider: Optional[TokenProvider] = None,
+                 on_disconnect: Optional[Callable[[], None]] = None):
+        self.url = (
+            supabase_url.rstrip('/').replace('https://', 'wss://').replace('http://', 'ws://')
+            + f'/realtime/v1/websocket?apikey={supabase_key}&vsn=1.0.0'
+        )
+        self.supabase_key = supabase_key
+        self.access_token = supabase_key
+        self.token_provider = token_provider
+        self.tables = list(tables)
+        self.on_change = on_change
+        self.on_disconnect = on_disconnect
+
+        # 設定
+        self.heartbeat_interval = 25
+        self.max_reconnect_delay = 60
+
+        # 接続状態（全チャンネルへの参加がサーバーに承認されている間のみTrue）
+        self.connected = False
+        self.running = False
+        self._ref = 0
+        self._pending_joins: Dict[str, str] = {}  # join ref -> topic
+        self._joined: Set[str] = set()
+
+    def _next_ref(self) -> str:
+        self._ref += 1
+        return str(self._ref)
+
+    async def run(self):
+        """購読ループ（切断時は指数バックオフで再接続）"""
+        self.running = True
+        delay = 1
+
+        while self.running:
+            try:
+                # 再接続のたびに最新のトークンで参加する
+                await self._refresh_token()
+                async with websockets.connect(self.url, ping_interval=None) as ws:
+                    await self._join(ws)
+
+                    heartbeat = asyncio.create_task(self._heartbeat(ws))
+                    try:
+                        async for raw in ws:
+                            if self._dispatch(json.loads(raw)):
+                                delay = 1
+                    finally:
+                        heartbeat.cancel()
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"Realtime接続エラー: {str(e)}")
+            finally:
+                self._set_disconnected()
+
+            if self.running:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def stop(self):
+        """購読停止"""
+        self.running = False
+
+    def _set_disconnected(self):
+        """参加状態を破棄（ポーリング間隔を戻せるよう呼び出し元へ通知）"""
+        was_connected = self.connected
+        self.connected = False
+        self._pending_joins.clear()
+        self._joined.clear()
+        if was_connected and self.on_disconnect:
+            self.on_disconnect()
+
+    async def _refresh_token(self) -> bool:
+        """最新のアクセストークンを取得（変わった場合True）"""
+        if not self.token_provider:
+            return False
+        try:
+            token = await self.token_provider() or self.supabase_key
+        except Exception as e:
+            logger.warning(f"Realtimeトークン取得エラー: {str(e)}")
+            return False
+        if token == self.access_token:
+            return False
+        self.access_token = token
+        return True
+
+    async def _join(self, ws):
+        """テーブルごとにpostgres_changesチャンネルへ参加（承認はphx_replyで確認）"""
+        for table in self.tables:
+            ref = self._next_ref()
+            topic = f'realtime:worker-{table}'
+            self._pending_joins[ref] = topic
+            await ws.send(json.dumps({
+                'topic': topic,
+                'event': 'phx_join',
+                'payload': {
+                    'config': {
+                        'postgres_changes': [{'event': '*', 'schema': 'public', 'table': table}]
+                    },
+                    'access_token': self.access_token
+                },
+                'ref': ref,
+                'join_ref': ref
+            }))
+
+    async def _heartbeat(self, ws):
+        """Phoenixハートビート（送らないとサーバー側で切断される）とトークンの更新"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await ws.send(json.dumps({
+                'topic': 'phoenix',
+                'event': 'heartbeat',
+                'payload': {},
+                'ref': self._next_ref()
+            }))
+
+            # JWTの期限が切れるとサーバー側でチャンネルが閉じられるため、更新されたトークンを送る
+            if await self._refresh_token():
+                for topic in self._joined | set(self._pending_joins.values()):
+                    await ws.send(json.dumps({
+                        'topic': topic,
+                        'event': 'access_token',
+                        'payload': {'access_token': self.access_token},
+                        'ref': self._next_ref()
+                    }))
+
+    def _dispatch(self, message: Dict[str, Any]) -> bool:
+        """変更イベントをコールバックへ渡す（全チャンネルの参加が承認された時点でTrue）"""
+        event = message.get('event')
+        topic = message.get('topic', '')
+        payload = message.get('payload') or {}
+
+        if event == 'phx_reply':
+            joined_topic = self._pending_joins.pop(message.get('ref'), None)
+            if payload.get('status') == 'error':
+                raise ChannelError(f"参加エラー {topic}: {payload.get('response')}")
+            if joined_topic and payload.get('status') == 'ok':
+                self._joined.add(joined_topic)
+                if not self._pending_joins and len(self._joined) == len(self.tables):
+                    self.connected = True
+                    logger.info(f"Realtime購読開始: {', '.join(self.tables)}")
+                    return True
+            return False
+
+        # チャンネルの終了・異常（トークン期限切れ・RLS・publicationの問題）は接続し直す
+        if event in ('phx_close', 'phx_error') and (topic in self._joined or topic in self._pending_joins.values()):
+            raise ChannelError(f"チャンネル切断 {topic}: {event}")
+        if event == 'system' and payload.get('status') == 'error':
+            raise ChannelError(f"チャンネルエラー {topic}: {payload.get('message')}")
+
+        if event != 'postgres_changes':
+            return False
+
+        data = message.get('payload', {}).get('data', {})
+        try:
+            self.on_change(
+                data.get('table', ''),
+                data.get('type', ''),
+                data.get('record') or {},
+                data.get('old_record') or {}
+            )
+        except Exception as e:
+            logger.error(f"Realtimeコールバックエラー: {str(e)}")
+        return False
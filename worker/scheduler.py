@@ -0,0 +1,150 @@
+"""
+予約タスクスケジューラーモジュール
+scheduled_atが先読み期間内のタスクを最小ヒープで保持し、次の実行予定時刻まで正確に待機させる
+"""
+
+import heapq
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Set, Tuple
+
+from task_queue import CLAIMABLE_STATUSES, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+class TaskScheduler:
+    def __init__(self, db):
+        self.db = db
+
+        # 設定
+        self.lookahead = float(os.getenv('SCHEDULE_LOOKAHEAD', '3600'))
+        self.max_prefetch = int(os.getenv('SCHEDULE_MAX_PREFETCH', '1000'))
+        # claim_tasksのp_affinity_grace_seconds（task_queue.TaskQueueと同じ設定）
+        self.affinity_grace = int(os.getenv('ACCOUNT_AFFINITY_GRACE', '30'))
+
+        # (実行予定時刻[epoch秒], task_id) の最小ヒープ
+        self.heap: List[Tuple[float, str]] = []
+        # task_id -> 現在の実行予定時刻（ヒープ内の古いエントリは遅延削除）
+        self.due_at: Dict[str, float] = {}
+        self.synced_until = 0.0
+        # アカウントアフィニティの猶予が切れる時刻[epoch秒]の最小ヒープ（同じ秒はまとめる）
+        self.affinity_wakes: List[float] = []
+        self._affinity_seconds: Set[float] = set()
+
+    def needs_sync(self) -> bool:
+        """先読み期間を使い切ったら再同期"""
+        return time.time() >= self.synced_until
+
+    def seconds_until_sync(self) -> float:
+        return max(0.0, self.synced_until - time.time())
+
+    async def sync(self):
+        """先読み期間内の予約タスクを取得してヒープを作り直す"""
+        now = datetime.now(timezone.utc)
+        until = now + timedelta(seconds=self.lookahead)
+
+        try:
+            result = await self.db.execute(
+                self.db.table('tasks').select('id,scheduled_at')
+                .in_('status', list(CLAIMABLE_STATUSES))
+                .gt('scheduled_at', now.isoformat())
+                .lte('scheduled_at', until.isoformat())
+                .order('scheduled_at')
+                .limit(self.max_prefetch)
+            )
+        except Exception as e:
+            logger.error(f"予約タスク同期エラー: {str(e)}")
+            # 失敗時は少し待ってから再同期
+            self.synced_until = time.time() + 30
+            return
+
+        self.heap.clear()
+        self.due_at.clear()
+        for row in result.data or []:
+            self.add(row['id'], row['scheduled_at'])
+
+        # 件数上限に達した場合は取得できた最後の時刻までを同期済みとする
+        if len(self.due_at) >= self.max_prefetch:
+            self.synced_until = max(self.due_at.values())
+        else:
+            self.synced_until = until.timestamp()
+
+        logger.debug(f"予約タスク同期: {len(self.due_at)}件")
+
+    def add(self, task_id: str, scheduled_at: str):
+        """予約タスクを追加・更新"""
+        due = parse_timestamp(scheduled_at).timestamp()
+        self.due_at[task_id] = due
+        heapq.heappush(self.heap, (due, task_id))
+
+    def remove(self, task_id: str):
+        """予約タスクを削除（ヒープからは次回参照時に取り除く）"""
+        self.due_at.pop(task_id, None)
+
+    def on_change(self, table: str, change_type: str, record: Dict[str, Any], old_record: Dict[str, Any]) -> bool:
+        """Realtime変更通知（予約の追加・変更・キャンセルを反映、変化があればTrue）"""
+        if table != 'tasks':
+            return False
+
+        task_id = record.get('id') or old_record.get('id')
+        if not task_id:
+            return False
+
+        scheduled_at = parse_timestamp(record.get('scheduled_at'))
+        if (
+            change_type != 'DELETE'
+            and record.get('status') in CLAIMABLE_STATUSES
+            and scheduled_at
+            and time.time() < scheduled_at.timestamp() <= self.synced_until
+        ):
+            if self.due_at.get(task_id) != scheduled_at.timestamp():
+                self.add(task_id, record['scheduled_at'])
+                return True
+            return False
+
+        if task_id in self.due_at:
+            self.remove(task_id)
+            return True
+        return False
+
+    def add_affinity_wake(self, record: Dict[str, Any]):
+        """取得可能になったタスクについて、他ワーカーに任せる猶予が切れる時刻にも起こす"""
+        # Realtime通知は一度きりなので、猶予中で取得できなかったタスクはフォールバックのポーリングまで気づけない
+        if not self.affinity_grace:
+            return
+        eligible_at = parse_timestamp(record.get('scheduled_at') or record.get('created_at'))
+        if not eligible_at:
+            return
+        due = math.ceil(eligible_at.timestamp() + self.affinity_grace)
+        if due > time.time() and due not in self._affinity_seconds:
+            self._affinity_seconds.add(due)
+            heapq.heappush(self.affinity_wakes, due)
+
+    def _discard_stale(self):
+        while self.heap and self.due_at.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def seconds_until_next(self) -> float:
+        """次の予約タスクまでの秒数（なければinf）"""
+        self._discard_stale()
+        next_due = min(self.heap[0][0] if self.heap else float('inf'),
+                       self.affinity_wakes[0] if self.affinity_wakes else float('inf'))
+        return max(0.0, next_due - time.time())
+
+    def pop_due(self) -> int:
+        """実行予定時刻に達したタスクをヒープから取り出して件数を返す"""
+        count = 0
+        now = time.time()
+        self._discard_stale()
+        while self.heap and self.heap[0][0] <= now:
+            _, task_id = heapq.heappop(self.heap)
+            self.due_at.pop(task_id, None)
+            count += 1
+            self._discard_stale()
+        while self.affinity_wakes and self.affinity_wakes[0] <= now:
+            self._affinity_seconds.discard(heapq.heappop(self.affinity_wakes))
+            count += 1
+        return count
@@ -0,0 +1,105 @@
+"""
+セレクタ解決モジュール
+UIの差異（言語・A/Bテスト）で変わる要素を複数の候補セレクタで同時に待ち、最初に一致したものを
+アカウント・ロケールごとに記憶して次回は先に試す（一致しなくなったら記憶を破棄して全候補で取り直す）。
+他の要素にも一致しうる汎用セレクタは競争させず、どの候補も一致しなかった場合のみ優先順に試して記憶しない
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional, List, Dict, Tuple
+
+from metrics_server import SELECTOR_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+class SelectorResolver:
+    def __init__(self):
+        # (グループ, アカウント, ロケール) -> 前回一致したセレクタ
+        self.winners: Dict[Tuple[str, Optional[str], str], str] = {}
+        # グループ -> hit（記憶したセレクタで一致）/ miss（記憶なし）/ stale（記憶が一致しなくなった）/
+        # fallback（汎用セレクタで一致）/ not_found
+        self.stats: Dict[str, Counter] = {}
+
+    def _count(self, group: str, result: str):
+        self.stats.setdefault(group, Counter())[result] += 1
+        SELECTOR_LOOKUPS.inc(group=group, result=result)
+
+    @staticmethod
+    async def _locale(page) -> str:
+        """表示中ページの言語（FacebookのUI言語はアカウント設定に従う）"""
+        try:
+            return await page.evaluate('document.documentElement.lang || navigator.language') or ''
+        except Exception:
+            return ''
+
+    async def resolve(self, page, group: str, candidates: List[str], account: Optional[str] = None,
+                      timeout: float = 3000, fallbacks: Optional[List[str]] = None):
+        """候補のいずれかに一致する要素を返す（どれも一致しなければfallbacksを順に試し、見つからなければNone）"""
+        key = (group, account, await self._locale(page))
+
+        winner = self.winners.get(key)
+        if winner:
+            try:
+                handle = await page.wait_for_selector(winner, timeout=timeout)
+                if handle:
+                    self._count(group, 'hit')
+                    return handle
+            except Exception:
+                pass
+            # UIが変わったので記憶を破棄し、残りの候補で取り直す（ページは読み込み済みなので通常はすぐ決まる）
+            self.winners.pop(key, None)
+            self._count(group, 'stale')
+            logger.info(f"セレクタの記憶を破棄: {group} {winner}")
+            candidates = [candidate for candidate in candidates if candidate != winner]
+        else:
+            self._count(group, 'miss')
+
+        selector, handle = await self._race(page, candidates, timeout)
+        if not handle:
+            # 競争の間にページは描画済みなので待たずに確認する
+            for fallback in fallbacks or []:
+                handle = await page.query_selector(fallback)
+                if handle:
+                    self._count(group, 'fallback')
+                    logger.info(f"汎用セレクタで一致（記憶しない）: {group} {fallback}")
+                    return handle
+            self._count(group, 'not_found')
+            return None
+
+        self.winners[key] = selector
+        logger.debug(f"セレクタを記憶: {group} {selector}")
+        return handle
+
+    async def _race(self, page, candidates: List[str], timeout: float):
+        """全候補を同時に待ち、最初に一致したもの（同時なら候補順で先のもの）を返す"""
+        if not candidates:
+            return None, None
+
+        tasks = {asyncio.create_task(page.wait_for_selector(selector, timeout=timeout)): selector
+                 for selector in candidates}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                matched = [
+                    (candidates.index(tasks[task]), tasks[task], task.result())
+                    for task in done
+                    if not task.cancelled() and task.exception() is None and task.result()
+                ]
+                if matched:
+                    _, selector, handle = min(matched, key=lambda match: match[0])
+                    return selector, handle
+            return None, None
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """グループごとのhit/miss/stale/fallback/not_found件数"""
+        return {group: dict(counts) for group, counts in self.stats.items()}
+
+# プロセス共通のリゾルバ（FacebookAutomationのインスタンス間で記憶を共有）
+selector_resolver = SelectorResolver()
@@ -0,0 +1,59 @@
+"""
+ブラウザセッション保存モジュール
+アカウントごとのPlaywright storage_stateをFernetで暗号化してローカルに保存
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+class SessionStore:
+    def __init__(self, cipher: Fernet, directory: Optional[str] = None):
+        self.cipher = cipher
+        self.directory = Path(directory or os.getenv('SESSION_DIR', 'sessions'))
+
+    def _path(self, account_id: str) -> Path:
+        return self.directory / f'{account_id}.session'
+
+    def load(self, account_id: str) -> Optional[Dict[str, Any]]:
+        """保存済みセッションを復号して返す（なければNone）"""
+        path = self._path(account_id)
+        if not path.exists():
+            return None
+
+        try:
+            return json.loads(self.cipher.decrypt(path.read_bytes()))
+        except (InvalidToken, ValueError) as e:
+            # 暗号鍵の変更や破損ファイルは破棄して通常ログインに戻す
+            logger.warning(f"セッション読み込みエラー {account_id}: {str(e)}")
+            self.delete(account_id)
+            return None
+
+    def save(self, account_id: str, state: Dict[str, Any]):
+        """セッションを暗号化して保存"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(account_id)
+            tmp_path = path.with_suffix('.tmp')
+
+            tmp_path.write_bytes(self.cipher.encrypt(json.dumps(state).encode()))
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+
+            logger.debug(f"セッション保存: {account_id}")
+
+        except Exception as e:
+            logger.error(f"セッション保存エラー {account_id}: {str(e)}")
+
+    def delete(self, account_id: str):
+        """保存済みセッションを削除"""
+        try:
+            self._path(account_id).unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"セッション削除エラー {account_id}: {str(e)}")
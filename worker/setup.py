@@ -102,6 +102,73 @@ async def test_worker():
         print(f"❌ テストエラー: {e}")
         return False
 
+async def profile_startup():
+    """起動時間をフェーズごとに計測"""
+    print("⏱️  起動時間の計測開始")
+    
+    import time
+    sys.path.insert(0, str(Path(__file__).parent))
+    phases = []
+    
+    async def measure(name, step):
+        started = time.perf_counter()
+        result = step()
+        if asyncio.iscoroutine(result):
+            result = await result
+        phases.append((name, (time.perf_counter() - started) * 1000))
+        return result
+    
+    try:
+        # 重いライブラリから順に読み込み（先に読み込んだものは後の計測に含まれない）
+        import importlib
+        for module in ['dotenv', 'cryptography.fernet', 'supabase', 'psutil', 'playwright.async_api']:
+            await measure(f"import {module}", lambda: importlib.import_module(module))
+        # ワーカー本体（起動時に読み込むモジュールのみ）
+        main_module = await measure("import main", lambda: importlib.import_module('main'))
+    except ImportError as e:
+        print(f"❌ インポートエラー: {e}")
+        return False
+    
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    if all(os.getenv(var) for var in ['SUPABASE_URL', 'SUPABASE_KEY', 'ENCRYPTION_KEY']):
+        # 稼働中のワーカーをofflineにしないよう別名で登録し、
+        # 同じホストのワーカーのアウトボックス・キャッシュ・セッションに触れないよう一時ディレクトリを使う
+        import shutil
+        import socket
+        import tempfile
+        profile_dir = tempfile.mkdtemp(prefix='worker-profile-')
+        os.environ['WORKER_NAME'] = os.getenv('WORKER_NAME', f'worker-{socket.gethostname()}') + '-profile'
+        os.environ['OUTBOX_PATH'] = os.path.join(profile_dir, 'outbox.db')
+        os.environ['THREAD_CACHE_PATH'] = os.path.join(profile_dir, 'thread_cache.db')
+        os.environ['SESSION_DIR'] = os.path.join(profile_dir, 'sessions')
+        try:
+            worker = await measure("ワーカー初期化", main_module.LocalWorker)
+            try:
+                await measure("ワーカー登録", worker.register_worker)
+                # リース延長RPCのみ計測（send_heartbeatはリース切れタスクの回収・アウトボックス再送も行うため呼ばない）
+                await measure("初回ハートビート", worker.task_queue.extend_leases)
+                await measure("ブラウザ起動", worker.launch_browser)
+            except Exception as e:
+                print(f"❌ 計測エラー: {e}")
+            finally:
+                await measure("クリーンアップ", worker.cleanup)
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+    else:
+        print("⚠️  環境変数が設定されていないため、登録・ブラウザ起動の計測を省略します")
+    
+    # フェーズごとの所要時間
+    width = max(len(name) for name, _ in phases)
+    print()
+    for name, elapsed in phases:
+        print(f"  {name:<{width}}  {elapsed:>8.1f} ms")
+    print(f"  {'合計':<{width}}  {sum(elapsed for _, elapsed in phases):>8.1f} ms")
+    
+    print("✅ 計測完了（モジュール単位の内訳は python -X importtime main.py で確認できます）")
+    return True
+
 async def main():
     """メイン関数"""
     if len(sys.argv) > 1:
@@ -110,8 +177,10 @@ async def main():
             await test_worker()
         elif command == "setup":
             await setup_worker()
+        elif command == "profile":
+            await profile_startup()
         else:
-            print("使用方法: python setup.py [setup|test]")
+            print("使用方法: python setup.py [setup|test|profile]")
     else:
         await setup_worker()
 
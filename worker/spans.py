@@ -0,0 +1,96 @@
+"""
+処理ステップ計測モジュール
+タスク内の各ステップ（ページ遷移・セレクタ待機・入力・クリック・DB呼び出し）の所要時間とRSS増減を計測し、
+LogSink経由でexecution_logsのstep_name/step_order/execution_time_ms/memory_usage_mbに一括記録
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any
+
+import psutil
+
+from metrics_server import STEP_DURATION
+from system_metrics import MB
+
+logger = logging.getLogger(__name__)
+
+# 実行中タスクのID（asyncioタスクごとに独立、並列処理でも混ざらない）
+_current_task_id: ContextVar[Optional[str]] = ContextVar('span_task_id', default=None)
+
+class Tracer:
+    def __init__(self):
+        self.enabled = os.getenv('SPANS_ENABLED', 'true').lower() == 'true'
+        self.sink = None
+        self.worker_id: Optional[str] = None
+
+        self.process = psutil.Process()
+        # task_id -> 次のstep_order
+        self._orders: Dict[str, int] = {}
+
+    def bind(self, sink, worker_id: Optional[str]):
+        """記録先のLogSinkとワーカーIDを設定"""
+        self.sink = sink
+        self.worker_id = worker_id
+
+    @contextmanager
+    def task(self, task_id: str):
+        """このブロック内のスパンをtask_idに紐付ける"""
+        token = _current_task_id.set(task_id)
+        self._orders[task_id] = 0
+        try:
+            yield
+        finally:
+            _current_task_id.reset(token)
+            self._orders.pop(task_id, None)
+
+    @contextmanager
+    def span(self, step_name: str, **details: Any):
+        """ステップの所要時間（単調時計）とRSS増減を計測（タスク外では何もしない）"""
+        task_id = _current_task_id.get()
+        if task_id is None:
+            yield
+            return
+
+        step_order = self._orders.get(task_id, 0) + 1
+        self._orders[task_id] = step_order
+
+        rss_before = self.process.memory_info().rss
+        started = time.monotonic()
+        status = 'completed'
+        try:
+            yield
+        except BaseException as e:
+            status = 'failed'
+            details['error'] = str(e) or type(e).__name__
+            raise
+        finally:
+            self._record(task_id, step_name, step_order, status, started, rss_before, details)
+
+    def _record(self, task_id: str, step_name: str, step_order: int, status: str,
+                started: float, rss_before: int, details: Dict[str, Any]):
+        elapsed = time.monotonic() - started
+        STEP_DURATION.observe(elapsed, step=step_name)
+
+        # execution_logsへの記録はSPANS_ENABLED時のみ
+        if not self.enabled or self.sink is None:
+            return
+        try:
+            self.sink.add({
+                'task_id': task_id,
+                'worker_id': self.worker_id,
+                'action': f'step_{status}',
+                'step_name': step_name,
+                'step_order': step_order,
+                'execution_time_ms': int(elapsed * 1000),
+                'memory_usage_mb': round((self.process.memory_info().rss - rss_before) / MB, 2),
+                'details': details or None
+            })
+        except Exception as e:
+            logger.debug(f"スパン記録エラー {step_name}: {str(e)}")
+
+# プロセス共通のトレーサー（FacebookAutomation・AsyncDBから参照）
+tracer = Tracer()
@@ -0,0 +1,129 @@
+"""
+システムメトリクス収集モジュール
+バックグラウンドでCPU・RSS・Chromiumメモリをサンプリングし、移動平均を保持
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Optional, List, Dict, Any
+
+import psutil
+
+from metrics_server import BROWSER_RSS, PROCESS_RSS
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Chromium系の子プロセス名
+CHROMIUM_PROCESS_NAMES = ('chrome', 'chromium', 'headless_shell')
+
+def chromium_processes(process: Optional[psutil.Process] = None) -> List[psutil.Process]:
+    """プロセス配下のChromiumプロセス"""
+    process = process or psutil.Process()
+    found = []
+    for child in process.children(recursive=True):
+        try:
+            if any(name in child.name().lower() for name in CHROMIUM_PROCESS_NAMES):
+                found.append(child)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return found
+
+def chromium_tree_rss(process: Optional[psutil.Process] = None) -> int:
+    """プロセス配下のChromiumプロセスのRSS合計（バイト）"""
+    total = 0
+    for child in chromium_processes(process):
+        try:
+            total += child.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return total
+
+class SystemMetricsSampler:
+    def __init__(self):
+        # 設定
+        self.interval = float(os.getenv('METRICS_SAMPLE_INTERVAL', '5'))
+        self.window = int(os.getenv('METRICS_WINDOW', '12'))
+        self.disk_interval = 600
+
+        self.process = psutil.Process()
+        self.cpu = deque(maxlen=self.window)
+        self.rss = deque(maxlen=self.window)
+        self.chromium_rss = deque(maxlen=self.window)
+        self.disk_percent: Optional[float] = None
+
+        self._last_disk_check = 0.0
+        self._last_sent: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """サンプリング開始"""
+        if self._task:
+            return
+        # 初回呼び出しは基準値を取るだけ（以降は前回呼び出しからの平均になる）
+        psutil.cpu_percent(interval=None)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """サンプリング停止"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.debug(f"メトリクス取得エラー: {str(e)}")
+
+    def sample(self):
+        """1回分のサンプルを追加"""
+        self.cpu.append(psutil.cpu_percent(interval=None))
+        self.rss.append(self.process.memory_info().rss)
+        self.chromium_rss.append(chromium_tree_rss(self.process))
+        PROCESS_RSS.set(self.rss[-1])
+        BROWSER_RSS.set(self.chromium_rss[-1])
+
+        # ディスク使用率は変化が遅いので低頻度で取得
+        loop_time = asyncio.get_running_loop().time()
+        if self.disk_percent is None or loop_time - self._last_disk_check >= self.disk_interval:
+            self.disk_percent = psutil.disk_usage('/').percent if os.path.exists('/') else 0
+            self._last_disk_check = loop_time
+
+    @staticmethod
+    def _average(values) -> float:
+        return sum(values) / len(values) if values else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """移動平均のスナップショット"""
+        return {
+            'cpu_percent': round(self._average(self.cpu), 1),
+            'memory_percent': psutil.virtual_memory().percent,
+            'rss_mb': round(self._average(self.rss) / MB, 1),
+            'chromium_rss_mb': round(self._average(self.chromium_rss) / MB, 1),
+            'disk_percent': self.disk_percent
+        }
+
+    def changed_stats(self, cpu_delta: float = 5.0, memory_delta_mb: float = 20.0) -> Optional[Dict[str, Any]]:
+        """前回送信時から大きく変化した場合のみスナップショットを返す"""
+        current = self.snapshot()
+        previous = self._last_sent
+
+        changed = (
+            not previous
+            or abs(current['cpu_percent'] - previous['cpu_percent']) >= cpu_delta
+            or abs(current['memory_percent'] - previous['memory_percent']) >= cpu_delta
+            or abs(current['rss_mb'] - previous['rss_mb']) >= memory_delta_mb
+            or abs(current['chromium_rss_mb'] - previous['chromium_rss_mb']) >= memory_delta_mb
+            or current['disk_percent'] != previous['disk_percent']
+        )
+        if not changed:
+            return None
+
+        self._last_sent = current
+        return current
@@ -0,0 +1,170 @@
+"""
+タスクキューモジュール
+claim_tasks RPC（supabase/step8_task_queue.sql）でタスクを原子的にリース付きで取得し、
+状態遷移はapply_task_transitions RPCで一括記録（outbox.py経由）。
+リースはハートビートごとに延長し、リース切れのタスクはreap_expired_leases RPCで再キューする
+"""
+
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Set, Dict, Any
+
+from metrics_server import QUEUE_LAG, TASK_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# claim_tasksが取得対象とするステータス
+CLAIMABLE_STATUSES = ('pending', 'retry')
+
+class PermanentTaskError(Exception):
+    """再試行しても成功しない失敗（再試行せずfailedにする）"""
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """PostgRESTのタイムスタンプ文字列をdatetimeに変換"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def is_claimable(record: Dict[str, Any]) -> bool:
+    """Realtimeで受信したタスク行が今すぐ取得対象かどうか（予約時刻前のもの・エージングによる更新は除く）"""
+    if record.get('status') not in CLAIMABLE_STATUSES:
+        return False
+    # age_task_priorities は aged_at と updated_at を同時に更新する（取得可能なタスクは増えていない）
+    if record.get('aged_at') and record.get('aged_at') == record.get('updated_at'):
+        return False
+    scheduled_at = parse_timestamp(record.get('scheduled_at'))
+    return scheduled_at is None or scheduled_at <= datetime.now(timezone.utc)
+
+class TaskQueue:
+    def __init__(self, db, worker_id: Optional[str] = None, batch_size: int = 1):
+        self.db = db
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+
+        # 優先度エージング間隔（秒、0で無効）。この間隔ごとに待機中タスクの優先度を1段階上げる
+        self.aging_interval = float(os.getenv('PRIORITY_AGING_INTERVAL', '600'))
+        self._last_aged = 0.0
+
+        # リース期間（秒）。ハートビートで延長されないまま過ぎると他のワーカーが再キューする
+        self.lease_seconds = int(os.getenv('TASK_LEASE_SECONDS', '120'))
+        # リース切れ回収の実行間隔（秒、0で無効）
+        self.reap_interval = float(os.getenv('LEASE_REAP_INTERVAL', '30'))
+        self._last_reaped = 0.0
+        # 失敗タスクの再試行間隔（秒）。base × 2^retry_count をmax_delayで頭打ちにし、後半50%にジッターを入れる
+        self.retry_base_delay = float(os.getenv('RETRY_BASE_DELAY', '60'))
+        self.retry_max_delay = float(os.getenv('RETRY_MAX_DELAY', '3600'))
+
+        # 他のワーカーがセッションを保持しているアカウントのタスクをそのワーカーに任せる秒数（0で無効）
+        self.affinity_grace = int(os.getenv('ACCOUNT_AFFINITY_GRACE', '30'))
+
+        # このプロセスが取得し、状態遷移がまだDBに適用されていないタスク（リース延長対象）
+        self.leased: Set[str] = set()
+
+    async def claim(self, limit: Optional[int] = None, exclude_accounts: Optional[List[str]] = None,
+                    warm_accounts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """タスクをこのワーカーにリースして返す（select→updateを1往復に集約、セッション保持中のアカウントを優先）"""
+        if not self.worker_id:
+            raise ValueError("worker_idが未設定のためタスクを取得できません")
+
+        result = await self.db.rpc('claim_tasks', {
+            'p_worker_id': self.worker_id,
+            'p_limit': limit or self.batch_size,
+            'p_exclude_accounts': exclude_accounts or [],
+            'p_lease_seconds': self.lease_seconds,
+            'p_warm_accounts': warm_accounts or [],
+            'p_affinity_grace_seconds': self.affinity_grace
+        })
+
+        tasks = result.data or []
+        self.leased.update(task['id'] for task in tasks)
+        if tasks:
+            logger.debug(f"タスク取得: {len(tasks)}件")
+
+        # キュー待ち時間（作成から取得まで）と再試行タスク数
+        now = datetime.now(timezone.utc)
+        for task in tasks:
+            if task.get('created_at'):
+                QUEUE_LAG.observe((now - parse_timestamp(task['created_at'])).total_seconds())
+            if task.get('retry_count'):
+                TASK_RETRIES.inc()
+        return tasks
+
+    def retry_at(self, retry_count: int) -> str:
+        """失敗したタスクの再試行日時（指数バックオフ＋ジッター。上限到達時のdead_letter判定はcomplete_task側）"""
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** retry_count))
+        delay = random.uniform(delay / 2, delay)
+        return (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat()
+
+    async def age_priorities(self) -> int:
+        """長く待たされているタスクの優先度を上げる（前回実行からaging_interval経過時のみ）"""
+        if not self.aging_interval or time.monotonic() - self._last_aged < self.aging_interval:
+            return 0
+        self._last_aged = time.monotonic()
+
+        try:
+            result = await self.db.rpc('age_task_priorities', {
+                'p_interval': f"{int(self.aging_interval)} seconds"
+            })
+        except Exception as e:
+            logger.error(f"優先度エージングエラー: {str(e)}")
+            return 0
+
+        aged = result.data or 0
+        if aged:
+            logger.info(f"優先度エージング: {aged}件")
+        return aged
+
+    async def extend_leases(self, warm_accounts: Optional[List[str]] = None) -> int:
+        """保持中タスクのリースを延長（last_heartbeatとcapabilities.warm_accountsの更新も兼ねる）"""
+        if not self.worker_id:
+            raise ValueError("worker_idが未設定のためリースを延長できません")
+
+        result = await self.db.rpc('extend_task_leases', {
+            'p_worker_id': self.worker_id,
+            'p_task_ids': list(self.leased),
+            'p_lease_seconds': self.lease_seconds,
+            'p_warm_accounts': warm_accounts
+        })
+        return result.data or 0
+
+    async def reap_expired(self) -> Dict[str, int]:
+        """リース切れタスクを再キューし、応答のないワーカーをofflineにする（前回実行からreap_interval経過時のみ）"""
+        if not self.reap_interval or time.monotonic() - self._last_reaped < self.reap_interval:
+            return {}
+        self._last_reaped = time.monotonic()
+
+        try:
+            result = await self.db.rpc('reap_expired_leases', {
+                'p_heartbeat_timeout': f"{self.lease_seconds} seconds"
+            })
+        except Exception as e:
+            logger.error(f"リース回収エラー: {str(e)}")
+            return {}
+
+        reaped = result.data or {}
+        if reaped.get('requeued') or reaped.get('offline'):
+            logger.warning(f"リース切れタスクを再キュー: {reaped.get('requeued', 0)}件、"
+                           f"応答のないワーカーをoffline: {reaped.get('offline', 0)}件")
+        return reaped
+
+    async def reserve_quota(self, task_id: str) -> Optional[bool]:
+        """タスクの送信枠をDB側で確保（上限到達はFalse、リース中でなければNone）"""
+        if not self.worker_id:
+            raise ValueError("worker_idが未設定のため送信枠を確保できません")
+
+        result = await self.db.rpc('reserve_send_quota', {
+            'p_task_id': task_id,
+            'p_worker_id': self.worker_id
+        })
+        return result.data
+
+    async def apply_transitions(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """アウトボックスの状態遷移を一括適用（完了・失敗・延期を1往復で記録）"""
+        response = await self.db.rpc('apply_task_transitions', {'p_items': items})
+        # DBに反映されたタスクはリース延長の対象から外す
+        self.leased.difference_update(item['task_id'] for item in items)
+        return response.data or []
@@ -0,0 +1,77 @@
+"""
+会話スレッドURLキャッシュモジュール
+アカウント・受信者名ごとに解決済みのMessengerスレッドURLをローカルのSQLiteに保持し（LRUで件数を制限）、
+2回目以降の送信で検索を省いてスレッドへ直接遷移できるようにする
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class ThreadCache:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('THREAD_CACHE_PATH', 'thread_cache.db')
+
+        # 設定
+        self.max_entries = int(os.getenv('THREAD_CACHE_SIZE', '1000'))  # アカウントごとの上限
+
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS threads (
+                account TEXT NOT NULL,
+                recipient_name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (account, recipient_name)
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_threads_lru ON threads(account, last_used)')
+        self.conn.commit()
+
+    def get(self, account: str, recipient_name: str) -> Optional[str]:
+        """キャッシュ済みのスレッドURL（使用時刻を更新）"""
+        row = self.conn.execute(
+            'SELECT url FROM threads WHERE account = ? AND recipient_name = ?',
+            (account, recipient_name)
+        ).fetchone()
+        if not row:
+            return None
+
+        self.conn.execute(
+            'UPDATE threads SET last_used = ? WHERE account = ? AND recipient_name = ?',
+            (time.time(), account, recipient_name)
+        )
+        self.conn.commit()
+        return row[0]
+
+    def put(self, account: str, recipient_name: str, url: str):
+        """スレッドURLを記録し、上限を超えた分を最も古く使われたものから削除"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO threads (account, recipient_name, url, last_used) VALUES (?, ?, ?, ?)',
+            (account, recipient_name, url, time.time())
+        )
+        self.conn.execute("""
+            DELETE FROM threads
+            WHERE account = ? AND recipient_name NOT IN (
+                SELECT recipient_name FROM threads WHERE account = ? ORDER BY last_used DESC LIMIT ?
+            )
+        """, (account, account, self.max_entries))
+        self.conn.commit()
+
+    def invalidate(self, account: str, recipient_name: str):
+        """古くなったエントリを削除（スレッドが開けなかった場合）"""
+        self.conn.execute(
+            'DELETE FROM threads WHERE account = ? AND recipient_name = ?',
+            (account, recipient_name)
+        )
+        self.conn.commit()
+        logger.info(f"スレッドキャッシュ破棄: {recipient_name}")
+
+    def close(self):
+        self.conn.close()